@@ -19,6 +19,8 @@ from langchain.prompts import PromptTemplate
 from langchain import hub
 from langchain.schema import HumanMessage, AIMessage
 
+from utils import rate_limited_http_client, rate_limited_async_http_client
+
 # LangGraph imports para memória
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph
@@ -118,6 +120,9 @@ class RAGAgentReact:
             model="gpt-4o",
             max_tokens=8000,   # Reduzido para evitar timeouts
             top_p=0.9,
+            # Limitador de taxa compartilhado com o RagSystem e a ingestão
+            http_client=rate_limited_http_client(),
+            http_async_client=rate_limited_async_http_client(),
         )
         
         # MUDANÇA PRINCIPAL: Substituir ConversationBufferMemory por LangGraph Memory
@@ -711,4 +716,4 @@ if __name__ == "__main__":
     except ValueError as e:
         print(f"Erro de configuração: {e}")
     except Exception as e:
-        print(f"Erro: {e}")
\ No newline at end of file
+        print(f"Erro: {e}")
\ No newline at end of file
@@ -0,0 +1,144 @@
+# answer_cache.py - Cache semântico de respostas do RAG
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bm25_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_THRESHOLD = 0.93  # similaridade de cosseno mínima entre as consultas
+
+
+def query_codes(query: str) -> Tuple[str, ...]:
+    """Tokens com dígitos da consulta (anos, códigos), normalizados como no índice BM25."""
+    return tuple(sorted({token for token in tokenize(query) if any(ch.isdigit() for ch in token)}))
+
+
+class SemanticAnswerCache:
+    """
+    Guarda respostas geradas indexadas pelo embedding da consulta. Uma nova
+    consulta reaproveita a resposta da consulta mais parecida se a similaridade
+    de cosseno for >= threshold, os anos e códigos numéricos das duas consultas
+    forem iguais ("... 2023" não reaproveita "... 2022", por mais parecidos que
+    sejam os embeddings), os parâmetros da busca forem os mesmos e a versão da
+    coleção não tiver mudado (uma mudança de versão esvazia o cache).
+
+    Entradas saem por LRU (max_entries) ou por idade (ttl_seconds).
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, max_entries: int = 500,
+                 ttl_seconds: Optional[float] = 24 * 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version: Optional[str] = None
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_id = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: list = []
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "tokens_saved": 0,
+                      "evictions": 0, "invalidations": 0}
+
+    def _check_version(self, version: str):
+        """Esvazia o cache quando a coleção ativa muda (nova ingestão ou atualização incremental)."""
+        if version != self.version:
+            if self._entries:
+                logger.info(f"🧹 Cache de respostas invalidado ({len(self._entries)} entradas): coleção em '{version}'")
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+            self._matrix = None
+            self.version = version
+
+    def _expire(self):
+        if self.ttl_seconds is None:
+            return
+        now = time.monotonic()
+        expired = [entry_id for entry_id, entry in self._entries.items() if now - entry["stored_at"] > self.ttl_seconds]
+        for entry_id in expired:
+            del self._entries[entry_id]
+            self.stats["evictions"] += 1
+        if expired:
+            self._matrix = None
+
+    def _similarities(self) -> Tuple[np.ndarray, list]:
+        if self._matrix is None:
+            self._matrix_ids = list(self._entries)
+            self._matrix = (np.stack([self._entries[i]["vector"] for i in self._matrix_ids])
+                            if self._matrix_ids else np.empty((0, 0), dtype=np.float32))
+        return self._matrix, self._matrix_ids
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def lookup(self, query: str, vector: Sequence[float], version: str, params: Tuple) -> Optional[Dict[str, Any]]:
+        """
+        Procura uma resposta para a consulta. Retorna a entrada (query, result,
+        similarity) ou None.
+        """
+        codes = query_codes(query)
+        with self._lock:
+            self._check_version(version)
+            self._expire()
+            self.stats["lookups"] += 1
+            matrix, ids = self._similarities()
+            if not ids:
+                self.stats["misses"] += 1
+                return None
+
+            scores = matrix @ self._normalize(vector)
+            for index in np.argsort(-scores):
+                if scores[index] < self.threshold:
+                    break
+                entry = self._entries[ids[index]]
+                if entry["params"] != params or entry["codes"] != codes:
+                    continue
+                self._entries.move_to_end(ids[index])
+                self.stats["hits"] += 1
+                self.stats["tokens_saved"] += entry["tokens"]
+                return {"query": entry["query"], "result": entry["result"], "similarity": float(scores[index])}
+
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, query: str, vector: Sequence[float], version: str, params: Tuple,
+              result: Dict[str, Any], tokens: int):
+        """Guarda a resposta de uma consulta (tokens: custo da geração, contabilizado a cada acerto)."""
+        with self._lock:
+            self._check_version(version)
+            self._entries[self._next_id] = {
+                "query": query,
+                "codes": query_codes(query),
+                "vector": self._normalize(vector),
+                "params": params,
+                "result": result,
+                "tokens": tokens,
+                "stored_at": time.monotonic(),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def info(self) -> Dict[str, Any]:
+        """Métricas do cache: taxa de acertos, tokens economizados, evicções e invalidações."""
+        with self._lock:
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "hit_rate": self.stats["hits"] / self.stats["lookups"] if self.stats["lookups"] else 0.0,
+            }
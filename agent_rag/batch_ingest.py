@@ -0,0 +1,348 @@
+# batch_ingest.py - Ingestão offline usando a Batch API da OpenAI
+import json
+import time
+import hashlib
+import logging
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+
+from openai import OpenAI
+
+import embedding
+from embedding import (
+    content_hash, description_store, embedding_cache, NearDuplicateFilter, DEDUP_THRESHOLD,
+    iter_multimodal_documents_by_file, _extract_page_payload, _iter_chunk_batches,
+    process_documents_to_chromadb, open_pdf, load_manifest, compare_with_manifest, compute_file_hash,
+    DEFAULT_IMAGE_OPTIONS, VISUAL_TEXT_COVERAGE_THRESHOLD,
+    VISION_MODEL, VISION_PROMPT, VISION_MAX_TOKENS, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS,
+)
+from collection_alias import resolve_collection_name
+
+logger = logging.getLogger(__name__)
+
+# Limites da Batch API: 50.000 requisições e 200 MB por arquivo de entrada
+BATCH_MAX_REQUESTS = 50_000
+BATCH_MAX_FILE_BYTES = 190 * 1024 * 1024
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def _vision_request(page_hash: str, image: Dict[str, Any]) -> Dict[str, Any]:
+    """Linha JSONL de uma descrição visual (mesmo corpo de describe_image_with_openai)."""
+    return {
+        "custom_id": page_hash,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": VISION_MODEL,
+            "messages": [{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": VISION_PROMPT},
+                    {"type": "image_url", "image_url": {
+                        "url": f"data:{image['mime_type']};base64,{image['img_base64']}",
+                        "detail": image["detail"]
+                    }},
+                ],
+            }],
+            "max_tokens": VISION_MAX_TOKENS,
+        },
+    }
+
+
+def _embedding_request(chunk_hash: str, text: str) -> Dict[str, Any]:
+    """Linha JSONL de um embedding."""
+    return {
+        "custom_id": chunk_hash,
+        "method": "POST",
+        "url": "/v1/embeddings",
+        "body": {"model": EMBEDDING_MODEL, "input": text, "dimensions": EMBEDDING_DIMENSIONS},
+    }
+
+
+def write_jsonl_parts(requests: Iterator[Dict[str, Any]], output_dir: Path, prefix: str) -> List[Path]:
+    """
+    Grava as requisições em um ou mais arquivos JSONL respeitando os limites
+    de tamanho e de requisições por lote. Retorna os arquivos gerados.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    parts: List[Path] = []
+    f = None
+    count = size = 0
+    try:
+        for request in requests:
+            line = (json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8")
+            if f is None or count >= BATCH_MAX_REQUESTS or size + len(line) > BATCH_MAX_FILE_BYTES:
+                if f:
+                    f.close()
+                parts.append(output_dir / f"{prefix}_{len(parts) + 1:03d}.jsonl")
+                f = open(parts[-1], "wb")
+                count = size = 0
+            f.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        if f:
+            f.close()
+    return parts
+
+
+class BatchRunner:
+    """Envia arquivos JSONL para a Batch API, acompanha os lotes e baixa os resultados."""
+
+    def __init__(self, client: OpenAI, work_dir: Path, poll_interval: float = 30.0):
+        self.client = client
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self.state_path = work_dir / "batch_state.json"
+
+    def _load_state(self) -> Dict[str, Any]:
+        if self.state_path.exists():
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def _save_state(self, state: Dict[str, Any]):
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        embedding._write_json_atomic(self.state_path, state)
+
+    def submit(self, phase: str, parts: List[Path], endpoint: str) -> List[str]:
+        """
+        Envia os arquivos de uma fase e retorna os ids dos lotes. Lotes já
+        enviados em uma execução anterior (registrados no estado) são reaproveitados.
+        """
+        state = self._load_state()
+        if state.get(phase, {}).get("batch_ids"):
+            logger.info(f"♻️ Reaproveitando {len(state[phase]['batch_ids'])} lote(s) da fase '{phase}'")
+            return state[phase]["batch_ids"]
+
+        batch_ids = []
+        for part in parts:
+            with open(part, "rb") as f:
+                uploaded = self.client.files.create(file=f, purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=uploaded.id,
+                endpoint=endpoint,
+                completion_window="24h"
+            )
+            logger.info(f"📤 Lote {batch.id} enviado ({part.name})")
+            batch_ids.append(batch.id)
+
+        state[phase] = {"batch_ids": batch_ids, "merged": False}
+        self._save_state(state)
+        return batch_ids
+
+    def wait(self, batch_ids: List[str]) -> List[Any]:
+        """Aguarda até todos os lotes chegarem a um estado final."""
+        pending = set(batch_ids)
+        finished = {}
+        while pending:
+            for batch_id in list(pending):
+                batch = self.client.batches.retrieve(batch_id)
+                if batch.status in BATCH_TERMINAL_STATUSES:
+                    logger.info(f"📥 Lote {batch_id}: {batch.status}")
+                    finished[batch_id] = batch
+                    pending.discard(batch_id)
+            if pending:
+                logger.info(f"⏳ {len(pending)} lote(s) em andamento, nova verificação em {self.poll_interval:.0f}s")
+                time.sleep(self.poll_interval)
+        return [finished[batch_id] for batch_id in batch_ids]
+
+    def iter_results(self, batches: List[Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Entrega (custom_id, corpo da resposta) das requisições bem-sucedidas."""
+        for batch in batches:
+            if not batch.output_file_id:
+                logger.error(f"❌ Lote {batch.id} sem arquivo de saída (status {batch.status})")
+                continue
+            content = self.client.files.content(batch.output_file_id).text
+            for line in content.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    logger.warning(f"⚠️ Requisição {result.get('custom_id')} falhou no lote {batch.id}")
+                    continue
+                yield result["custom_id"], response["body"]
+
+    def bind(self, run_key: str):
+        """
+        Associa o estado a uma entrada (PDFs e opções). Um estado de outra
+        entrada, como o de uma execução anterior sobre arquivos que mudaram
+        desde então, é descartado em vez de fazer as fases 1 e 2 serem puladas.
+        """
+        state = self._load_state()
+        if state.get("run_key") != run_key:
+            if state:
+                logger.info("🧹 Estado de lotes de outra entrada descartado; as fases serão refeitas")
+            self._save_state({"run_key": run_key})
+
+    def mark_merged(self, phase: str):
+        state = self._load_state()
+        state.setdefault(phase, {})["merged"] = True
+        self._save_state(state)
+
+    def is_merged(self, phase: str) -> bool:
+        return self._load_state().get(phase, {}).get("merged", False)
+
+
+def _iter_missing_vision_requests(pdf_files: List[Path], page_options: Dict[str, Any],
+                                  counters: Dict[str, int]) -> Iterator[Dict[str, Any]]:
+    """
+    Renderiza as páginas e entrega as requisições das imagens ainda sem
+    descrição. Imagens idênticas (mesmo page_hash, em qualquer página ou PDF)
+    geram uma única requisição: a Batch API rejeita custom_ids repetidos.
+    """
+    seen = set()
+    for pdf_path in pdf_files:
+        doc = open_pdf(pdf_path)
+        if doc is None:
+            continue
+        with doc:
+            for i, page in enumerate(doc):
+                try:
+                    payload = _extract_page_payload(page, i + 1, page_options)
+                except Exception as e:
+                    logger.error(f"❌ Erro na página {i + 1} de {pdf_path.name}: {e}")
+                    continue
+                images = {image["page_hash"]: image for image in payload["images"]}
+                cached = description_store.get_many(list(images))
+                for page_hash, image in images.items():
+                    if page_hash in cached or page_hash in seen:
+                        counters["cached"] += 1
+                        continue
+                    seen.add(page_hash)
+                    counters["requests"] += 1
+                    yield _vision_request(page_hash, image)
+
+
+def _iter_missing_embedding_requests(data_path: str, pdf_files: List[Path], loader_options: Dict[str, Any],
+                                     counters: Dict[str, int], dedup_threshold: Optional[float] = DEDUP_THRESHOLD,
+                                     per_file_dedup: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Gera os chunks (apenas com as descrições já em cache, sem chamadas de
+    visão) e entrega os embeddings ausentes, descartando os quase duplicados
+    como a fase 3 fará (entre todos os PDFs, ou dentro de cada PDF com
+    per_file_dedup, como na atualização incremental).
+    """
+    seen = set()
+    deduplicator = NearDuplicateFilter(dedup_threshold) if dedup_threshold else None
+    for _pdf_path, pages in iter_multimodal_documents_by_file(data_path, pdf_files=pdf_files,
+                                                              cached_descriptions_only=True, **loader_options):
+        if per_file_dedup and dedup_threshold:
+            deduplicator = NearDuplicateFilter(dedup_threshold)
+        for batch_docs in _iter_chunk_batches(pages, deduplicator=deduplicator):
+            texts = {content_hash(d["document"]): d["document"] for d in batch_docs}
+            cached = embedding_cache.get_many(list(texts), EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+            for chunk_hash, text in texts.items():
+                if chunk_hash in cached or chunk_hash in seen:
+                    counters["cached"] += 1
+                    continue
+                seen.add(chunk_hash)
+                counters["requests"] += 1
+                yield _embedding_request(chunk_hash, text)
+
+
+def run_batch_ingestion(data_path: str = "data", chroma_path: str = "chroma_db", collection_name: str = "seade_gecon",
+                        work_dir: str = "batch_jobs", poll_interval: float = 30.0, base_url: Optional[str] = None,
+                        incremental: bool = False, dedup_threshold: Optional[float] = DEDUP_THRESHOLD,
+                        **loader_options):
+    """
+    Ingestão em três fases usando a Batch API (metade do preço, sem limites interativos):
+
+    1. renderiza as páginas e envia em lote as descrições visuais ausentes do
+       cache, gravando os resultados em description_store;
+    2. gera os chunks e envia em lote os embeddings ausentes, gravando-os em
+       embedding_cache;
+    3. executa process_documents_to_chromadb (completo ou incremental), que
+       encontra tudo em cache.
+
+    Com incremental=True as fases 1 e 2 cobrem apenas os PDFs novos ou
+    alterados segundo o manifesto da versão ativa.
+
+    O estado dos lotes fica em work_dir/batch_state.json: uma execução
+    interrompida com a mesma entrada (hashes dos PDFs e opções) volta a
+    acompanhar os mesmos lotes; com outra entrada o estado é descartado.
+    Páginas ou chunks cujo lote falhou são tratados pelas chamadas síncronas
+    normais na fase 3.
+    base_url permite apontar para um servidor compatível (ex.: fake_openai_server).
+    """
+    client = OpenAI(base_url=base_url) if base_url else OpenAI()
+    runner = BatchRunner(client, Path(work_dir), poll_interval=poll_interval)
+    pdf_files = sorted(Path(data_path).glob("*.pdf"))
+    if not pdf_files:
+        logger.error(f"❌ Nenhum PDF encontrado em {data_path}")
+        return
+    if incremental:
+        known_files = load_manifest(chroma_path, resolve_collection_name(chroma_path, collection_name)).get("files", {})
+        file_hashes, added, changed, _removed = compare_with_manifest(pdf_files, known_files)
+        to_update = set(added + changed)
+        pdf_files = [pdf for pdf in pdf_files if pdf.name in to_update]
+        file_hashes = {name: file_hashes[name] for name in to_update}
+    else:
+        file_hashes = {pdf.name: compute_file_hash(pdf) for pdf in pdf_files}
+        logger.info(f"📋 Atualização incremental: {len(pdf_files)} PDF(s) novo(s) ou alterado(s) nas fases em lote")
+
+    page_options = {
+        "text_coverage_threshold": loader_options.get("text_coverage_threshold", VISUAL_TEXT_COVERAGE_THRESHOLD),
+        "figure_mode": loader_options.get("figure_mode", False),
+        "table_mode": loader_options.get("table_mode", True),
+        "image_options": {**DEFAULT_IMAGE_OPTIONS, **(loader_options.get("image_options") or {})},
+    }
+    runner.bind(hashlib.sha256(json.dumps({
+        "files": file_hashes, "page_options": page_options,
+        "dedup_threshold": dedup_threshold, "incremental": incremental,
+    }, sort_keys=True).encode("utf-8")).hexdigest())
+
+    # Fase 1: descrições visuais
+    if pdf_files and not runner.is_merged("vision"):
+        logger.info("\n🖼️ FASE 1: descrições visuais em lote")
+        counters = {"requests": 0, "cached": 0}
+        parts = write_jsonl_parts(
+            _iter_missing_vision_requests(pdf_files, page_options, counters), Path(work_dir), "vision"
+        )
+        logger.info(f"   {counters['requests']} descrições a gerar, {counters['cached']} já em cache")
+        if parts:
+            batches = runner.wait(runner.submit("vision", parts, "/v1/chat/completions"))
+            descriptions = {
+                page_hash: body["choices"][0]["message"]["content"]
+                for page_hash, body in runner.iter_results(batches)
+            }
+            description_store.put_many(descriptions)
+            logger.info(f"   ✅ {len(descriptions)} descrições gravadas no cache")
+        runner.mark_merged("vision")
+
+    # Fase 2: embeddings
+    if pdf_files and not runner.is_merged("embeddings"):
+        logger.info("\n🧮 FASE 2: embeddings em lote")
+        counters = {"requests": 0, "cached": 0}
+        parts = write_jsonl_parts(
+            _iter_missing_embedding_requests(data_path, pdf_files, loader_options, counters, dedup_threshold,
+                                             per_file_dedup=incremental),
+            Path(work_dir), "embeddings"
+        )
+        logger.info(f"   {counters['requests']} embeddings a gerar, {counters['cached']} já em cache")
+        if parts:
+            batches = runner.wait(runner.submit("embeddings", parts, "/v1/embeddings"))
+            vectors = {
+                chunk_hash: body["data"][0]["embedding"]
+                for chunk_hash, body in runner.iter_results(batches)
+            }
+            embedding_cache.put_many(vectors, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+            logger.info(f"   ✅ {len(vectors)} embeddings gravados no cache")
+        runner.mark_merged("embeddings")
+
+    # Fase 3: gravação na coleção a partir dos caches
+    logger.info("\n🗄️ FASE 3: gravação na coleção")
+    process_documents_to_chromadb(
+        data_path=data_path,
+        chroma_path=chroma_path,
+        collection_name=collection_name,
+        incremental=incremental,
+        dedup_threshold=dedup_threshold,
+        **loader_options
+    )
+    runner.state_path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    run_batch_ingestion()
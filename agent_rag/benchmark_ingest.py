@@ -0,0 +1,308 @@
+# benchmark_ingest.py - Benchmark de vazão da ingestão contra o servidor OpenAI falso
+import io
+import os
+import json
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+import functools
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import fitz
+from PIL import Image, ImageDraw
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from fake_openai_server import start_fake_server
+from utils import DEFAULT_RATE_LIMITS, RATE_LIMITS_ENV_VAR
+
+WORDS = ("produção veículos emprego indústria exportação licenciamento autopeças região metropolitana "
+         "faturamento investimento montadoras participação crescimento trimestre média anual estado").split()
+FOOTER = "Fundação Seade - Pesquisa de Atividade Econômica Paulista. Metodologia disponível em seade.gov.br."
+
+
+def _sentence(rng: random.Random, n_words: int = 14) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + f" ({rng.randint(1, 999)},{rng.randint(0, 9)}%)."
+
+
+def _add_footer(page):
+    page.insert_text((40, page.rect.height - 25), FOOTER, fontsize=7)
+
+
+def _text_page(doc, rng: random.Random):
+    page = doc.new_page()
+    page.insert_textbox(fitz.Rect(50, 50, page.rect.width - 50, page.rect.height - 50),
+                        " ".join(_sentence(rng) for _ in range(45)), fontsize=10)
+    _add_footer(page)
+
+
+def _table_page(doc, rng: random.Random, rows: int = 12, cols: int = 5):
+    """Tabela com linhas de grade (detectável por page.find_tables)."""
+    page = doc.new_page()
+    page.insert_text((50, 60), "Tabela - " + _sentence(rng, 6), fontsize=12)
+    x0, y0, cell_w, cell_h = 50, 80, 100, 22
+    for r in range(rows + 1):
+        page.draw_line((x0, y0 + r * cell_h), (x0 + cols * cell_w, y0 + r * cell_h))
+    for c in range(cols + 1):
+        page.draw_line((x0 + c * cell_w, y0), (x0 + c * cell_w, y0 + rows * cell_h))
+    for r in range(rows):
+        for c in range(cols):
+            text = rng.choice(WORDS) if r == 0 or c == 0 else f"{rng.uniform(0, 10000):.1f}"
+            page.insert_text((x0 + c * cell_w + 4, y0 + r * cell_h + 15), text, fontsize=9)
+    page.insert_textbox(fitz.Rect(50, y0 + rows * cell_h + 20, page.rect.width - 50, page.rect.height - 50),
+                        " ".join(_sentence(rng) for _ in range(6)), fontsize=10)
+    _add_footer(page)
+
+
+def _chart_page(doc, rng: random.Random, bars: int = 24):
+    """Gráfico de barras vetorial com pouco texto (classificado como visual)."""
+    page = doc.new_page()
+    page.insert_text((50, 60), "Gráfico - " + _sentence(rng, 5), fontsize=12)
+    base_y, width = 600, (page.rect.width - 100) / bars
+    page.draw_line((50, base_y), (page.rect.width - 50, base_y))
+    for i in range(bars):
+        height = rng.uniform(30, 450)
+        page.draw_rect(fitz.Rect(50 + i * width + 2, base_y - height, 50 + (i + 1) * width - 2, base_y),
+                       color=(0, 0, 0.5), fill=(rng.random() * 0.3, 0.4, 0.8))
+    _add_footer(page)
+
+
+def _image_page(doc, rng: random.Random):
+    """Página com uma imagem raster grande (mapa/foto simulada)."""
+    page = doc.new_page()
+    img = Image.new("RGB", (800, 600), (235, 235, 235))
+    draw = ImageDraw.Draw(img)
+    for _ in range(60):
+        x, y = rng.randint(0, 760), rng.randint(0, 560)
+        draw.ellipse((x, y, x + rng.randint(10, 40), y + rng.randint(10, 40)),
+                     fill=(rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    page.insert_image(fitz.Rect(50, 80, page.rect.width - 50, 520), stream=buffered.getvalue())
+    page.insert_text((50, 60), "Mapa - " + _sentence(rng, 5), fontsize=12)
+    _add_footer(page)
+
+
+def generate_synthetic_pdfs(output_dir: Path, num_pdfs: int, pages_per_pdf: int, seed: int = 42) -> List[Path]:
+    """Gera PDFs que alternam páginas de texto, tabela, gráfico e imagem (com rodapé repetido)."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    builders = (_text_page, _table_page, _chart_page, _text_page, _image_page)
+    paths = []
+    for i in range(num_pdfs):
+        doc = fitz.open()
+        for j in range(pages_per_pdf):
+            builders[j % len(builders)](doc, rng)
+        path = output_dir / f"relatorio_sintetico_{i + 1:03d}.pdf"
+        doc.save(path)
+        doc.close()
+        paths.append(path)
+    return paths
+
+
+def _maxrss_mb(who) -> float:
+    """ru_maxrss em MB (dado em bytes no macOS e em KB nos demais Unix)."""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _current_rss_mb() -> float:
+    """
+    RSS atual do processo (Linux: /proc/self/statm; demais: psutil, ou o pico via
+    getrusage). Retorna 0 se nenhuma dessas fontes estiver disponível.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    if resource is not None:
+        return _maxrss_mb(resource.RUSAGE_SELF)
+    return 0.0
+
+
+class StageMonitor:
+    """
+    Mede tempo ocupado, chamadas e pico de RSS por etapa da ingestão. As etapas
+    rodam em threads simultâneas, então o pico de uma etapa é o maior RSS
+    amostrado enquanto ela estava ativa.
+    """
+
+    def __init__(self, sample_interval: float = 0.05):
+        self.sample_interval = sample_interval
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._active: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self.peak_rss_mb = 0.0
+
+    def wrap(self, stage: str, func):
+        self.stages.setdefault(stage, {"calls": 0, "busy_s": 0.0, "peak_rss_mb": 0.0})
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self._lock:
+                self._active[stage] = self._active.get(stage, 0) + 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                rss = _current_rss_mb()
+                with self._lock:
+                    self._active[stage] -= 1
+                    self.stages[stage]["calls"] += 1
+                    self.stages[stage]["busy_s"] += elapsed
+                    self.stages[stage]["peak_rss_mb"] = max(self.stages[stage]["peak_rss_mb"], rss)
+        return wrapper
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            rss = _current_rss_mb()
+            with self._lock:
+                self.peak_rss_mb = max(self.peak_rss_mb, rss)
+                for stage, active in self._active.items():
+                    if active:
+                        self.stages[stage]["peak_rss_mb"] = max(self.stages[stage]["peak_rss_mb"], rss)
+
+    def __enter__(self):
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._sampler.join()
+
+    def reset(self):
+        with self._lock:
+            for values in self.stages.values():
+                values.update(calls=0, busy_s=0.0, peak_rss_mb=0.0)
+            self.peak_rss_mb = 0.0
+
+
+def _instrument(embedding, monitor: StageMonitor):
+    """Envolve as funções de cada etapa do pipeline de embedding.py com o monitor."""
+    embedding._extract_page_payload = monitor.wrap("render", embedding._extract_page_payload)
+    embedding.describe_image_with_openai = monitor.wrap("describe", embedding.describe_image_with_openai)
+    embedding._split_page_into_chunks = monitor.wrap("chunk", embedding._split_page_into_chunks)
+    embedding.embed_texts_with_cache = monitor.wrap("embed", embedding.embed_texts_with_cache)
+    from chromadb.api.models.Collection import Collection
+    Collection.upsert = monitor.wrap("write", Collection.upsert)
+    Collection.add = monitor.wrap("write", Collection.add)
+
+
+def run_pass(embedding, label: str, server, monitor: StageMonitor, total_pages: int, **options) -> Dict[str, Any]:
+    """Executa process_documents_to_chromadb uma vez e coleta as métricas."""
+    stats = server.RequestHandlerClass.state.stats
+    before = dict(stats)
+    uploads_before = dict(embedding.upload_stats)
+    monitor.reset()
+
+    start = time.perf_counter()
+    embedding.process_documents_to_chromadb(data_path="data", chroma_path="chroma_db",
+                                            collection_name="benchmark", **options)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "label": label,
+        "seconds": elapsed,
+        "pages_per_sec": total_pages / elapsed if elapsed else 0.0,
+        "embedding_calls": stats["embedding_calls"] - before["embedding_calls"],
+        "embedding_inputs": stats["embedding_inputs"] - before["embedding_inputs"],
+        "vision_calls": stats["chat_calls"] - before["chat_calls"],
+        "rate_limited": stats["rate_limited"] - before["rate_limited"],
+        "bytes_uploaded": stats["bytes_received"] - before["bytes_received"],
+        "image_bytes": embedding.upload_stats["bytes"] - uploads_before["bytes"],
+        "peak_rss_mb": monitor.peak_rss_mb,
+        "stages": {stage: dict(values) for stage, values in monitor.stages.items()},
+    }
+
+
+def print_report(results: List[Dict[str, Any]]):
+    print("\n📊 RESULTADOS")
+    for r in results:
+        print(f"\n▶ {r['label']}: {r['seconds']:.1f}s, {r['pages_per_sec']:.2f} páginas/s, pico RSS {r['peak_rss_mb']:.0f} MB")
+        print(f"   embeddings: {r['embedding_calls']} chamadas / {r['embedding_inputs']} textos | "
+              f"visão: {r['vision_calls']} chamadas | 429: {r['rate_limited']}")
+        print(f"   enviados: {r['bytes_uploaded'] / 1024:.1f} KB (imagens: {r['image_bytes'] / 1024:.1f} KB)")
+        print(f"   {'etapa':<10} {'chamadas':>9} {'ocupado (s)':>12} {'pico RSS (MB)':>14}")
+        for stage, values in r["stages"].items():
+            print(f"   {stage:<10} {values['calls']:>9} {values['busy_s']:>12.2f} {values['peak_rss_mb']:>14.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de vazão da ingestão (sem custo, contra um servidor falso).")
+    parser.add_argument("--pdfs", type=int, default=5, help="Número de PDFs sintéticos")
+    parser.add_argument("--pages", type=int, default=20, help="Páginas por PDF")
+    parser.add_argument("--latency", type=float, default=0.2, help="Latência simulada por requisição (s)")
+    parser.add_argument("--rpm", type=int, default=None, help="Limite de requisições por minuto do servidor falso")
+    parser.add_argument("--tpm", type=int, default=None, help="Limite de tokens por minuto do servidor falso")
+    parser.add_argument("--workers", type=int, default=1, help="max_workers da ingestão")
+    parser.add_argument("--figures", action="store_true", help="Usa figure_mode")
+    parser.add_argument("--work-dir", default=None, help="Diretório de trabalho (padrão: temporário)")
+    args = parser.parse_args()
+
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="benchmark_ingest_")).resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    os.chdir(work_dir)  # caches, ChromaDB e dados isolados do projeto
+
+    server, base_url = start_fake_server(latency=args.latency, rpm=args.rpm, tpm=args.tpm)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+    if args.rpm is None and args.tpm is None:
+        # Servidor sem limites não envia x-ratelimit-*: sem isso o limitador do
+        # cliente ficaria nos limites padrão e o benchmark mediria o throttle
+        unlimited = {"rpm": 10**6, "tpm": 10**9}
+        os.environ.setdefault(RATE_LIMITS_ENV_VAR, json.dumps({model: unlimited for model in [*DEFAULT_RATE_LIMITS, "*"]}))
+
+    print(f"🧪 Servidor falso em {base_url} (latência {args.latency}s, rpm {args.rpm}, tpm {args.tpm})")
+    print(f"📁 Diretório de trabalho: {work_dir}")
+    start = time.perf_counter()
+    generate_synthetic_pdfs(Path("data"), args.pdfs, args.pages)
+    print(f"📄 {args.pdfs} PDFs x {args.pages} páginas gerados em {time.perf_counter() - start:.1f}s")
+
+    import embedding  # importado após configurar o ambiente (cliente e caches usam o diretório atual)
+
+    monitor = StageMonitor()
+    _instrument(embedding, monitor)
+    total_pages = args.pdfs * args.pages
+    options = {"max_workers": args.workers, "figure_mode": args.figures}
+    if args.workers > 1:
+        print("⚠️ Com --workers > 1 a renderização ocorre em outros processos: a etapa 'render' não é medida.")
+
+    results = []
+    try:
+        with monitor:
+            results.append(run_pass(embedding, "ingestão completa (caches frios)", server, monitor, total_pages, **options))
+            results.append(run_pass(embedding, "ingestão completa (caches quentes)", server, monitor, total_pages, **options))
+    finally:
+        server.shutdown()
+
+    print_report(results)
+    if resource is not None:
+        print(f"\n   Pico de RSS do processo: {_maxrss_mb(resource.RUSAGE_SELF):.0f} MB, "
+              f"processos filhos: {_maxrss_mb(resource.RUSAGE_CHILDREN):.0f} MB")
+    else:
+        print(f"\n   Pico de RSS amostrado do processo: {monitor.peak_rss_mb:.0f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+# benchmark_render.py - Compara a renderização em DPI fixo + redimensionamento com a renderização adaptativa
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import multiprocessing
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import fitz
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Tamanhos de página em pontos (1/72 polegada)
+PAGE_SIZES = {"A4": (595, 842), "A3": (842, 1191), "Letter": (612, 792), "A4-paisagem": (842, 595)}
+
+
+def create_sample_pdf(path: Path, pages_per_size: int = 3):
+    """Gera um PDF com páginas de vários tamanhos contendo texto e desenhos vetoriais."""
+    doc = fitz.open()
+    for name, (width, height) in PAGE_SIZES.items():
+        for i in range(pages_per_size):
+            page = doc.new_page(width=width, height=height)
+            page.insert_text((50, 60), f"Página {name} {i + 1}", fontsize=18)
+            page.insert_textbox(fitz.Rect(50, 80, width - 50, height / 2),
+                                "Indicadores do setor automotivo paulista. " * 40, fontsize=10)
+            for j in range(40):
+                x = 50 + j * (width - 100) / 40
+                page.draw_rect(fitz.Rect(x, height - 60 - (j * 7) % 250, x + 8, height - 60),
+                               color=(0, 0, 0.6), fill=(0.2, 0.4, 0.8))
+    doc.save(path)
+    doc.close()
+
+
+def render_legacy(page, image_options: Dict[str, Any]) -> Image.Image:
+    """Renderização anterior: sempre 200 DPI e redução com LANCZOS para 1024px."""
+    pix = page.get_pixmap(dpi=200)
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    max_size = image_options.get("max_size", 1024)
+    if img.width > max_size or img.height > max_size:
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    if image_options["grayscale"]:
+        img = img.convert("L")
+    return img
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Pico de RSS do processo em MB (getrusage no Unix, psutil no Windows); None se nenhum estiver disponível."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss é dado em bytes no macOS e em KB nos demais Unix
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024 / 1024
+    return None
+
+
+def _run_mode(mode: str, pdf_paths: List[str], image_options: Dict[str, Any], result_queue):
+    """Executada em um processo novo, para que o pico de memória seja só deste modo."""
+    from page_render import render_page_image, DEFAULT_IMAGE_OPTIONS
+
+    options = {**DEFAULT_IMAGE_OPTIONS, **image_options}
+    render = render_legacy if mode == "legacy" else render_page_image
+    baseline_rss = _peak_rss_mb()
+    if baseline_rss is None:
+        # Sem getrusage nem psutil: mede só as alocações feitas pelo Python
+        tracemalloc.start()
+    timings = []
+    pixels = 0
+    for pdf_path in pdf_paths:
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                start = time.perf_counter()
+                img = render(page, options)
+                timings.append(time.perf_counter() - start)
+                pixels += img.width * img.height
+    if baseline_rss is None:
+        peak_delta_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    else:
+        peak_delta_mb = _peak_rss_mb() - baseline_rss
+    result_queue.put({
+        "mode": mode,
+        "pages": len(timings),
+        "total_s": sum(timings),
+        "ms_per_page": 1000 * sum(timings) / len(timings) if timings else 0.0,
+        "max_ms": 1000 * max(timings) if timings else 0.0,
+        "output_pixels_per_page": pixels / len(timings) if timings else 0,
+        "peak_rss_delta_mb": peak_delta_mb,
+    })
+
+
+def run_benchmark(pdf_paths: List[str], image_options: Dict[str, Any]) -> List[Dict[str, Any]]:
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for mode in ("legacy", "adaptive"):
+        result_queue = context.Queue()
+        process = context.Process(target=_run_mode, args=(mode, pdf_paths, image_options, result_queue))
+        process.start()
+        results.append(result_queue.get())
+        process.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de renderização de páginas (DPI fixo x adaptativo).")
+    parser.add_argument("pdfs", nargs="*", help="PDFs a renderizar (padrão: PDF sintético com vários tamanhos)")
+    parser.add_argument("--pages-per-size", type=int, default=3, help="Páginas por tamanho no PDF sintético")
+    parser.add_argument("--grayscale", action="store_true")
+    parser.add_argument("--max-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    image_options = {"grayscale": args.grayscale, "max_size": args.max_size}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_paths = args.pdfs
+        if not pdf_paths:
+            sample = Path(tmp_dir) / "amostra.pdf"
+            create_sample_pdf(sample, args.pages_per_size)
+            pdf_paths = [str(sample)]
+        results = run_benchmark(pdf_paths, image_options)
+
+    print(f"\n{'modo':<10} {'páginas':>8} {'ms/página':>10} {'máx ms':>8} {'pixels/página':>14} {'pico RSS (MB)':>14}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['pages']:>8} {r['ms_per_page']:>10.1f} {r['max_ms']:>8.1f} "
+              f"{r['output_pixels_per_page']:>14.0f} {r['peak_rss_delta_mb']:>14.1f}")
+    legacy, adaptive = results
+    if adaptive["ms_per_page"]:
+        print(f"\n⚡ Renderização adaptativa {legacy['ms_per_page'] / adaptive['ms_per_page']:.1f}x mais rápida")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
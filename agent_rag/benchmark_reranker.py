@@ -0,0 +1,133 @@
+# benchmark_reranker.py - Latência e concordância de ranking entre backends do reranker
+import sys
+import time
+import random
+import argparse
+from typing import Dict, Any, List
+
+import numpy as np
+
+from onnx_reranker import load_reranker
+
+DEFAULT_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+QUERIES = [
+    "balança comercial paulista 2023",
+    "indústria automotiva no ABC paulista",
+    "produção de veículos no estado de São Paulo",
+    "exportações de autopeças por destino",
+    "emprego formal na indústria de transformação",
+    "participação do IPI na arrecadação",
+    "licenciamento de veículos novos por mês",
+    "investimentos anunciados pelas montadoras",
+]
+WORDS = ("produção veículos emprego indústria exportação licenciamento autopeças região metropolitana ABC "
+         "faturamento investimento montadoras participação crescimento trimestre balança comercial IPI").split()
+
+
+def synthetic_documents(count: int, seed: int = 7) -> List[str]:
+    """Parágrafos sintéticos de tamanhos variados (de ~30 a ~600 palavras)."""
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(30, 600))) for _ in range(count)]
+
+
+def collection_documents(chroma_path: str, collection_name: str, count: int) -> List[str]:
+    """Amostra de chunks reais da versão ativa da coleção."""
+    import chromadb
+    from collection_alias import resolve_collection_name
+
+    client = chromadb.PersistentClient(path=chroma_path)
+    collection = client.get_collection(resolve_collection_name(chroma_path, collection_name))
+    return collection.get(limit=count, include=["documents"])["documents"]
+
+
+def _ranks(scores: np.ndarray) -> np.ndarray:
+    return np.argsort(np.argsort(-scores))
+
+
+def agreement(reference: np.ndarray, other: np.ndarray, top_n: int = 5) -> Dict[str, float]:
+    """
+    Spearman entre as pontuações, acerto do 1º colocado, sobreposição do top-n
+    e diferença absoluta média/máxima entre os valores das pontuações.
+    """
+    ref_ranks, other_ranks = _ranks(reference), _ranks(other)
+    spearman = float(np.corrcoef(ref_ranks, other_ranks)[0, 1]) if len(reference) > 1 else 1.0
+    top_ref = set(np.argsort(-reference)[:top_n])
+    top_other = set(np.argsort(-other)[:top_n])
+    return {
+        "spearman": spearman,
+        "top1": float(np.argmax(reference) == np.argmax(other)),
+        f"top{top_n}_overlap": len(top_ref & top_other) / min(top_n, len(reference)),
+        "mean_abs_diff": float(np.mean(np.abs(reference - other))),
+        "max_abs_diff": float(np.max(np.abs(reference - other))),
+    }
+
+
+def run_backend(backend: str, model: str, threads: int, pairs_per_query: List[List[List[str]]],
+                batch_size: int, repeats: int) -> Dict[str, Any]:
+    start = time.perf_counter()
+    reranker = load_reranker(model, backend=backend, intra_op_threads=threads)
+    load_s = time.perf_counter() - start
+
+    # Aquecimento (alocação de buffers, compilação de kernels)
+    reranker.predict(pairs_per_query[0], batch_size=batch_size, show_progress_bar=False)
+
+    latencies, scores = [], []
+    for _ in range(repeats):
+        scores = []
+        for pairs in pairs_per_query:
+            start = time.perf_counter()
+            scores.append(np.asarray(reranker.predict(pairs, batch_size=batch_size, show_progress_bar=False)))
+            latencies.append(1000 * (time.perf_counter() - start))
+    return {
+        "backend": getattr(reranker, "backend", backend),
+        "load_s": load_s,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "scores": scores,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara os backends do reranker (latência e concordância).")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--backends", default="torch,onnx-fp32,onnx",
+                        help="Backends separados por vírgula; o primeiro é a referência")
+    parser.add_argument("--threads", type=int, default=None, help="Threads de inferência")
+    parser.add_argument("--docs", type=int, default=10, help="Documentos por consulta (top_k_retrieval)")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--chroma-path", default=None, help="Usa chunks reais da coleção em vez de texto sintético")
+    parser.add_argument("--collection", default="seade_gecon")
+    args = parser.parse_args()
+
+    total_docs = args.docs * len(QUERIES)
+    if args.chroma_path:
+        documents = collection_documents(args.chroma_path, args.collection, total_docs)
+    else:
+        documents = synthetic_documents(total_docs)
+    pairs_per_query = [
+        [[query, doc] for doc in documents[i * args.docs:(i + 1) * args.docs]]
+        for i, query in enumerate(QUERIES)
+    ]
+    pairs_per_query = [pairs for pairs in pairs_per_query if pairs]
+
+    results = [run_backend(backend.strip(), args.model, args.threads, pairs_per_query, args.batch_size, args.repeats)
+               for backend in args.backends.split(",")]
+
+    reference = results[0]
+    print(f"\n{'backend':<10} {'carga (s)':>10} {'p50 (ms)':>9} {'p95 (ms)':>9} {'spearman':>9} {'top-1':>6} "
+          f"{'top-5':>6} {'|Δ| médio':>10} {'|Δ| máx':>8}")
+    for result in results:
+        per_query = [agreement(ref, other) for ref, other in zip(reference["scores"], result["scores"])]
+        mean = {key: float(np.mean([q[key] for q in per_query])) for key in per_query[0]}
+        max_diff = max(q["max_abs_diff"] for q in per_query)
+        print(f"{result['backend']:<10} {result['load_s']:>10.2f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+              f"{mean['spearman']:>9.3f} {mean['top1']:>6.2f} {mean['top5_overlap']:>6.2f} "
+              f"{mean['mean_abs_diff']:>10.4f} {max_diff:>8.4f}")
+    print(f"\nConcordância e |Δ| (diferença das pontuações) medidos em relação a '{reference['backend']}' "
+          f"({len(pairs_per_query)} consultas x {args.docs} documentos, {args.repeats} repetições).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
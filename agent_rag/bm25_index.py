@@ -0,0 +1,312 @@
+# bm25_index.py - Índice lexical BM25 (arquivos numpy mapeados em memória) por versão de coleção
+import re
+import json
+import heapq
+import shutil
+import logging
+import unicodedata
+from array import array
+from pathlib import Path
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_DIRNAME = "bm25"
+BM25_FORMAT = 2
+CHUNK_TYPE_CODES = {"text": 0, "table": 1, "visual": 2}
+MAX_TOKEN_LENGTH = 40  # tokens maiores (URLs, linhas de tabela sem espaços) são ignorados
+POSTINGS_PER_RUN = 1_000_000  # postings em memória antes de gravar um bloco ordenado em disco
+
+# Números com separadores (8703.23.10, 1.234,5) ficam inteiros; o resto é dividido em palavras
+_TOKEN_RE = re.compile(r"\d+(?:[.,/-]\d+)*|\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokens em minúsculas e sem acentos (consultas sem acento encontram o texto acentuado)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [token for token in _TOKEN_RE.findall(text) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+class _StringTable:
+    """
+    Strings gravadas como um único bloco UTF-8 mais um array de offsets (sem a
+    largura fixa dos arrays '<U' do numpy). Strings ordenadas podem ser
+    buscadas com find: a ordem dos bytes UTF-8 é a mesma dos code points.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def load(cls, blob_path: Path, offsets_path: Path) -> "_StringTable":
+        blob = (np.memmap(blob_path, dtype=np.uint8, mode="r") if blob_path.stat().st_size
+                else np.zeros(0, dtype=np.uint8))
+        return cls(blob, np.load(offsets_path, mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def raw(self, i: int) -> bytes:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i: int) -> str:
+        return self.raw(i).decode("utf-8")
+
+    def find(self, value: str) -> Optional[int]:
+        target = value.encode("utf-8")
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.raw(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < len(self) and self.raw(low) == target else None
+
+
+class _StringWriter:
+    """Grava strings em sequência no formato de _StringTable."""
+
+    def __init__(self, blob_path: Path):
+        self.file = open(blob_path, "wb")
+        self.offsets = array("q", [0])
+
+    def append(self, value: bytes):
+        self.file.write(value)
+        self.offsets.append(self.offsets[-1] + len(value))
+
+    def close(self, offsets_path: Path):
+        self.file.close()
+        np.save(offsets_path, np.frombuffer(self.offsets, dtype=np.int64))
+
+
+def _write_run(run_dir: Path, postings: Dict[str, List[Tuple[int, int]]]):
+    """Grava um bloco de postings ordenado por termo (etapa da ordenação externa)."""
+    run_dir.mkdir()
+    terms = _StringWriter(run_dir / "terms.bin")
+    offsets = array("q", [0])
+    docs, tfs = array("i"), array("f")
+    for term in sorted(postings):
+        terms.append(term.encode("utf-8"))
+        for doc_index, tf in postings[term]:
+            docs.append(doc_index)
+            tfs.append(tf)
+        offsets.append(len(docs))
+    terms.close(run_dir / "term_offsets.npy")
+    np.save(run_dir / "offsets.npy", np.frombuffer(offsets, dtype=np.int64))
+    np.save(run_dir / "posting_docs.npy", np.array(docs, dtype=np.int32))
+    np.save(run_dir / "posting_tfs.npy", np.array(tfs, dtype=np.float32))
+
+
+def _merge_runs(target_dir: Path, run_dirs: List[Path]) -> int:
+    """
+    Intercala os blocos (k-way, por termo) nos arquivos finais do índice,
+    escrevendo as postings direto em arrays mapeados. Os blocos estão na ordem
+    dos documentos, então as postings de cada termo saem ordenadas por
+    documento. Retorna o número de termos.
+    """
+    runs = [{
+        "terms": _StringTable.load(run_dir / "terms.bin", run_dir / "term_offsets.npy"),
+        "offsets": np.load(run_dir / "offsets.npy", mmap_mode="r"),
+        "docs": np.load(run_dir / "posting_docs.npy", mmap_mode="r"),
+        "tfs": np.load(run_dir / "posting_tfs.npy", mmap_mode="r"),
+    } for run_dir in run_dirs]
+    total = sum(len(run["docs"]) for run in runs)
+    posting_docs = np.lib.format.open_memmap(target_dir / "posting_docs.npy", mode="w+", dtype=np.int32, shape=(total,))
+    posting_tfs = np.lib.format.open_memmap(target_dir / "posting_tfs.npy", mode="w+", dtype=np.float32, shape=(total,))
+
+    terms = _StringWriter(target_dir / "terms.bin")
+    offsets = array("q", [0])
+    heap = [(run["terms"].raw(0), index, 0) for index, run in enumerate(runs) if len(run["terms"])]
+    heapq.heapify(heap)
+    cursor = 0
+    while heap:
+        term = heap[0][0]
+        while heap and heap[0][0] == term:
+            _term, index, position = heapq.heappop(heap)
+            run = runs[index]
+            start, end = run["offsets"][position], run["offsets"][position + 1]
+            posting_docs[cursor:cursor + end - start] = run["docs"][start:end]
+            posting_tfs[cursor:cursor + end - start] = run["tfs"][start:end]
+            cursor += end - start
+            if position + 1 < len(run["terms"]):
+                heapq.heappush(heap, (run["terms"].raw(position + 1), index, position + 1))
+        terms.append(term)
+        offsets.append(cursor)
+
+    terms.close(target_dir / "term_offsets.npy")
+    np.save(target_dir / "offsets.npy", np.frombuffer(offsets, dtype=np.int64))
+    posting_docs.flush()
+    posting_tfs.flush()
+    # Liberar os mapeamentos antes de remover os blocos (necessário no Windows)
+    del posting_docs, posting_tfs, runs
+    return len(offsets) - 1
+
+
+def index_path(chroma_path: str, collection_name: str) -> Path:
+    """Diretório do índice BM25 de uma versão (coleção física) do ChromaDB."""
+    return Path(chroma_path) / BM25_DIRNAME / collection_name
+
+
+def build_bm25_index(collection, chroma_path: str, page_size: int = 1000,
+                     postings_per_run: int = POSTINGS_PER_RUN) -> Optional[Path]:
+    """
+    Constrói o índice BM25 de todos os chunks da coleção e o grava em
+    chroma_path/bm25/<nome da coleção>. As postings são acumuladas em blocos de
+    até postings_per_run, gravados ordenados em disco e intercalados no fim,
+    de modo que a memória não cresce com o corpus. O índice é escrito em um
+    diretório temporário e trocado no fim: leitores nunca veem um índice parcial.
+    """
+    target = index_path(chroma_path, collection.name)
+    tmp_dir = target.with_name(target.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    pending = 0
+    run_dirs: List[Path] = []
+    doc_ids = _StringWriter(tmp_dir / "doc_ids.bin")
+    doc_lengths = array("i")
+    doc_types = array("B")
+
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        for chunk_id, document, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+            doc_index = len(doc_lengths)
+            counts = Counter(tokenize(document or ""))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_index, tf))
+            pending += len(counts)
+            doc_ids.append(chunk_id.encode("utf-8"))
+            doc_lengths.append(sum(counts.values()))
+            doc_types.append(CHUNK_TYPE_CODES.get((metadata or {}).get("chunk_type", "text"), 0))
+        offset += len(page["ids"])
+        if pending >= postings_per_run:
+            run_dirs.append(tmp_dir / f"run_{len(run_dirs):04d}")
+            _write_run(run_dirs[-1], postings)
+            postings, pending = {}, 0
+    if postings:
+        run_dirs.append(tmp_dir / f"run_{len(run_dirs):04d}")
+        _write_run(run_dirs[-1], postings)
+    postings = {}
+    doc_ids.close(tmp_dir / "doc_id_offsets.npy")
+
+    if not doc_lengths:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        logger.warning("⚠️ Coleção vazia, índice BM25 não construído")
+        return None
+
+    num_terms = _merge_runs(tmp_dir, run_dirs)
+    for run_dir in run_dirs:
+        shutil.rmtree(run_dir)
+    lengths = np.array(doc_lengths, dtype=np.int32)
+    np.save(tmp_dir / "doc_lengths.npy", lengths)
+    np.save(tmp_dir / "doc_types.npy", np.array(doc_types, dtype=np.uint8))
+    with open(tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump({"format": BM25_FORMAT, "documents": len(lengths), "terms": num_terms,
+                   "avg_doc_length": float(lengths.mean()), "k1": BM25_K1, "b": BM25_B}, f)
+
+    old_dir = target.with_name(target.name + ".old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if target.exists():
+        target.rename(old_dir)
+    tmp_dir.rename(target)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    logger.info(f"🔤 Índice BM25 construído: {len(lengths)} chunks, {num_terms} termos ({len(run_dirs)} bloco(s))")
+    return target
+
+
+def delete_bm25_index(chroma_path: str, collection_name: str):
+    """Remove o índice de uma versão descartada da coleção."""
+    shutil.rmtree(index_path(chroma_path, collection_name), ignore_errors=True)
+
+
+class BM25Index:
+    """
+    Índice BM25 carregado com mmap: a abertura só lê os cabeçalhos dos
+    arquivos; as listas de postings são paginadas sob demanda pelo sistema
+    operacional. Termos e ids ficam em blocos UTF-8 com offsets (_StringTable).
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        with open(self.directory / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != BM25_FORMAT:
+            raise ValueError("índice em formato antigo; execute uma nova ingestão para reconstruí-lo")
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        self.avg_doc_length = meta["avg_doc_length"] or 1.0
+        load = lambda name: np.load(self.directory / name, mmap_mode="r")
+        self.terms = _StringTable.load(self.directory / "terms.bin", self.directory / "term_offsets.npy")
+        self.offsets = load("offsets.npy")
+        self.posting_docs = load("posting_docs.npy")
+        self.posting_tfs = load("posting_tfs.npy")
+        self.doc_lengths = load("doc_lengths.npy")
+        self.doc_types = load("doc_types.npy")
+        self.doc_ids = _StringTable.load(self.directory / "doc_ids.bin", self.directory / "doc_id_offsets.npy")
+        self.num_docs = len(self.doc_lengths)
+
+    @classmethod
+    def load(cls, chroma_path: str, collection_name: str) -> Optional["BM25Index"]:
+        """Abre o índice da coleção, ou retorna None se ele não existir."""
+        directory = index_path(chroma_path, collection_name)
+        if not (directory / "meta.json").exists():
+            return None
+        try:
+            return cls(directory)
+        except Exception as e:
+            logger.warning(f"Erro ao abrir o índice BM25 de '{collection_name}': {e}")
+            return None
+
+    def _term_index(self, term: str) -> Optional[int]:
+        return self.terms.find(term)
+
+    def search(self, query: str, top_k: int = 10,
+               chunk_types: Optional[Sequence[str]] = None) -> List[Tuple[str, float]]:
+        """Retorna até top_k (id do chunk, pontuação BM25), em ordem decrescente."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        matched = False
+        for term, query_tf in Counter(tokenize(query)).items():
+            term_index = self._term_index(term)
+            if term_index is None:
+                continue
+            start, end = self.offsets[term_index], self.offsets[term_index + 1]
+            docs = np.asarray(self.posting_docs[start:end])
+            tfs = np.asarray(self.posting_tfs[start:end])
+            idf = np.log(1 + (self.num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_doc_length)
+            scores[docs] += query_tf * idf * tfs * (self.k1 + 1) / (tfs + norm)
+            matched = True
+        if not matched:
+            return []
+
+        if chunk_types:
+            allowed = [CHUNK_TYPE_CODES[t] for t in chunk_types if t in CHUNK_TYPE_CODES]
+            scores[~np.isin(self.doc_types, allowed)] = 0
+
+        top_k = min(top_k, int(np.count_nonzero(scores)))
+        if top_k == 0:
+            return []
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.doc_ids[int(i)], float(scores[i])) for i in best]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Combina listas ordenadas de ids pela soma de 1 / (k + posição)."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
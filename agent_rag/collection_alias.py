@@ -0,0 +1,122 @@
+# collection_alias.py - Aliases de coleções do ChromaDB (troca blue/green)
+import os
+import json
+import logging
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ALIASES_FILENAME = "collection_aliases.json"
+
+
+def _aliases_path(chroma_path: str) -> Path:
+    """Caminho do arquivo de aliases dentro do diretório do ChromaDB."""
+    return Path(chroma_path) / ALIASES_FILENAME
+
+
+def load_aliases(chroma_path: str) -> Dict[str, Any]:
+    """Carrega o mapa alias -> versões da coleção."""
+    aliases_path = _aliases_path(chroma_path)
+    if not aliases_path.exists():
+        return {}
+    try:
+        with open(aliases_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Erro ao ler aliases de coleção: {e}")
+        return {}
+
+
+def _save_aliases(chroma_path: str, aliases: Dict[str, Any]):
+    """Grava os aliases de forma atômica (arquivo temporário + rename)."""
+    aliases_path = _aliases_path(chroma_path)
+    aliases_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = aliases_path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(aliases, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, aliases_path)
+
+
+def aliases_signature(chroma_path: str) -> Optional[int]:
+    """Assinatura barata (mtime) do arquivo de aliases, usada para detectar trocas."""
+    try:
+        return _aliases_path(chroma_path).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def new_collection_version(alias: str) -> str:
+    """Gera o nome de uma nova versão (staging) da coleção."""
+    return f"{alias}_v{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+
+def resolve_collection_name(chroma_path: str, alias: str) -> str:
+    """
+    Resolve o alias para o nome da coleção ativa.
+    Sem alias registrado, o próprio nome é usado (coleções criadas antes dos aliases).
+    """
+    entry = load_aliases(chroma_path).get(alias)
+    if entry and entry.get("current"):
+        return entry["current"]
+    return alias
+
+
+def get_alias_entry(chroma_path: str, alias: str) -> Dict[str, Any]:
+    """Retorna a entrada do alias (current, previous, updated_at) ou um dicionário vazio."""
+    return load_aliases(chroma_path).get(alias, {})
+
+
+def promote_collection(chroma_path: str, alias: str, collection_name: str, keep_previous: int = 1,
+                       legacy_collection: Optional[str] = None) -> List[str]:
+    """
+    Aponta o alias para collection_name mantendo até keep_previous versões
+    anteriores para rollback. legacy_collection é tratada como versão anterior
+    quando o alias ainda não existe. Retorna as versões que saíram da retenção
+    e podem ser removidas do ChromaDB.
+    """
+    aliases = load_aliases(chroma_path)
+    entry = aliases.get(alias, {})
+    old_current = entry.get("current") or legacy_collection
+    previous = [name for name in entry.get("previous", []) if name != collection_name]
+    if old_current and old_current != collection_name:
+        previous.insert(0, old_current)
+
+    aliases[alias] = {
+        "current": collection_name,
+        "previous": previous[:keep_previous],
+        "updated_at": datetime.now().isoformat()
+    }
+    _save_aliases(chroma_path, aliases)
+    logger.info(f"🔀 Alias '{alias}' agora aponta para '{collection_name}'")
+    return previous[keep_previous:]
+
+
+def rollback_collection(chroma_path: str, alias: str) -> Optional[str]:
+    """Reaponta o alias para a versão anterior. Retorna o novo nome ativo ou None."""
+    aliases = load_aliases(chroma_path)
+    entry = aliases.get(alias, {})
+    previous = entry.get("previous", [])
+    if not previous:
+        logger.warning(f"⚠️ Nenhuma versão anterior registrada para '{alias}'")
+        return None
+
+    target = previous[0]
+    aliases[alias] = {
+        "current": target,
+        "previous": [entry["current"]] + previous[1:] if entry.get("current") else previous[1:],
+        "updated_at": datetime.now().isoformat()
+    }
+    _save_aliases(chroma_path, aliases)
+    logger.info(f"↩️ Alias '{alias}' revertido para '{target}'")
+    return target
+
+
+def mark_collection_updated(chroma_path: str, alias: str):
+    """Registra que a coleção ativa foi alterada no lugar (ex.: atualização incremental)."""
+    aliases = load_aliases(chroma_path)
+    entry = aliases.get(alias, {"current": alias, "previous": []})
+    entry["updated_at"] = datetime.now().isoformat()
+    aliases[alias] = entry
+    _save_aliases(chroma_path, aliases)
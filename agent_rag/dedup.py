@@ -0,0 +1,143 @@
+# dedup.py - Eliminação de chunks quase duplicados (MinHash + LSH)
+import re
+import zlib
+import hashlib
+import logging
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEDUP_THRESHOLD = 0.85  # similaridade de Jaccard estimada a partir da qual um chunk é descartado
+DEDUP_NUM_PERM = 64
+DEDUP_BANDS = 16
+DEDUP_SHINGLE_SIZE = 5
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Mesma forma de número do tokenizador BM25 (8703.23.10, 1.234,5 ficam inteiros)
+_NUMBER_RE = re.compile(r"\d+(?:[.,/-]\d+)*")
+
+
+def _shingles(text: str, size: int) -> List[str]:
+    """Shingles de palavras do texto normalizado (minúsculas, sem pontuação)."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return [" ".join(words)]
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def _numbers_key(text: str) -> str:
+    """Hash da sequência de números do texto (anos, valores, códigos)."""
+    return hashlib.sha256(" ".join(_NUMBER_RE.findall(text)).encode("utf-8")).hexdigest()
+
+
+class NearDuplicateFilter:
+    """
+    Detecta chunks quase duplicados durante a ingestão. Cada chunk é resumido
+    por uma assinatura MinHash dos seus shingles de palavras; o índice LSH
+    (DEDUP_BANDS faixas) encontra candidatos e a similaridade estimada decide
+    se o chunk repete um já mantido. Cópias exatas são resolvidas por hash.
+
+    Os números são tratados como atributos exatos: um chunk só é quase
+    duplicado de outro com a mesma sequência de números. A próxima edição de
+    um relatório, com o mesmo texto e estatísticas atualizadas, é mantida.
+
+    Guarda apenas as assinaturas (DEDUP_NUM_PERM inteiros de 32 bits por chunk)
+    e o hash dos números, não o texto.
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, num_perm: int = DEDUP_NUM_PERM,
+                 bands: int = DEDUP_BANDS, shingle_size: int = DEDUP_SHINGLE_SIZE, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm deve ser múltiplo de bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self._exact: Dict[str, Tuple[str, str]] = {}
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._signatures: List[np.ndarray] = []
+        self._numbers: List[str] = []
+        self._owners: List[Tuple[str, str]] = []
+        self.stats = {"chunks": 0, "duplicates": 0, "exact_duplicates": 0, "bytes_saved": 0, "tokens_saved": 0}
+
+    def signature(self, text: str) -> np.ndarray:
+        """Assinatura MinHash do texto."""
+        hashes = np.array(
+            [zlib.crc32(shingle.encode("utf-8")) for shingle in _shingles(text, self.shingle_size)],
+            dtype=np.uint64
+        )
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def check(self, text: str, chunk_id: str, file_name: str) -> Optional[Tuple[str, str]]:
+        """
+        Verifica um chunk. Se for quase duplicado de um chunk já mantido, retorna
+        (chunk_id, file_name) desse chunk; caso contrário registra-o e retorna None.
+        """
+        self.stats["chunks"] += 1
+        exact_key = hashlib.sha256(" ".join(_WORD_RE.findall(text.lower())).encode("utf-8")).hexdigest()
+        if exact_key in self._exact:
+            self.stats["exact_duplicates"] += 1
+            return self._exact[exact_key]
+
+        numbers_key = _numbers_key(text)
+        signature = self.signature(text)
+        band_keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+        candidates = set()
+        for bucket, key in zip(self._buckets, band_keys):
+            candidates.update(bucket.get(key, ()))
+        for candidate in candidates:
+            if self._numbers[candidate] != numbers_key:
+                continue
+            if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                return self._owners[candidate]
+
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        self._numbers.append(numbers_key)
+        self._owners.append((chunk_id, file_name))
+        self._exact[exact_key] = (chunk_id, file_name)
+        for bucket, key in zip(self._buckets, band_keys):
+            bucket.setdefault(key, []).append(index)
+        return None
+
+    def filter_chunks(self, chunks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Tuple[Dict[str, Any], Tuple[str, str]]]]:
+        """
+        Separa os chunks (no formato de _split_page_into_chunks) em mantidos e
+        descartados; cada descartado vem acompanhado do (chunk_id, file_name) original.
+        """
+        kept, dropped = [], []
+        for chunk in chunks:
+            text = chunk.get("body", chunk["document"])
+            original = self.check(text, chunk["metadata"]["chunk_id"], chunk["metadata"]["file_name"])
+            if original is None:
+                kept.append(chunk)
+                continue
+            self.stats["duplicates"] += 1
+            self.stats["bytes_saved"] += len(chunk["document"].encode("utf-8"))
+            self.stats["tokens_saved"] += chunk["metadata"].get("token_count", 0)
+            dropped.append((chunk, original))
+        return kept, dropped
+
+    def report(self, batch_size: int) -> Dict[str, Any]:
+        """Resumo da deduplicação: chunks descartados, bytes, tokens e chamadas de embedding evitadas."""
+        duplicates = self.stats["duplicates"]
+        return {
+            **self.stats,
+            "duplicate_ratio": duplicates / self.stats["chunks"] if self.stats["chunks"] else 0.0,
+            "embedding_calls_saved": -(-duplicates // batch_size),
+        }
+
+    def log_report(self, batch_size: int):
+        report = self.report(batch_size)
+        logger.info(f"🧹 Deduplicação: {report['duplicates']} de {report['chunks']} chunks descartados "
+                    f"({report['duplicate_ratio']:.1%}, {report['exact_duplicates']} cópias exatas), "
+                    f"{report['bytes_saved'] / 1024:.1f} KB e ~{report['tokens_saved']} tokens não enviados, "
+                    f"~{report['embedding_calls_saved']} chamadas de embedding evitadas")
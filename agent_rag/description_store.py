@@ -0,0 +1,168 @@
+# description_store.py - Armazenamento indexado das descrições visuais das páginas
+import os
+import sys
+import json
+import logging
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Optional, Sequence, Any
+
+logger = logging.getLogger(__name__)
+
+
+class DescriptionStore:
+    """
+    Armazena as descrições geradas pelo modelo de visão em um único arquivo
+    SQLite indexado por hash da página, substituindo os arquivos
+    cache/<page_hash>.json.
+    """
+
+    def __init__(self, db_path: str = "cache/descriptions.sqlite"):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS descriptions (
+                page_hash TEXT PRIMARY KEY,
+                description TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, page_hash: str) -> Optional[str]:
+        """Retorna a descrição de uma página ou None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT description FROM descriptions WHERE page_hash = ?", (page_hash,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, page_hashes: Sequence[str]) -> Dict[str, str]:
+        """Busca várias descrições de uma vez. Retorna apenas os hashes encontrados."""
+        found: Dict[str, str] = {}
+        unique_hashes = list(dict.fromkeys(page_hashes))
+        # SQLite limita o número de parâmetros por consulta
+        step = 500
+        with self._lock:
+            for i in range(0, len(unique_hashes), step):
+                chunk = unique_hashes[i:i + step]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT page_hash, description FROM descriptions WHERE page_hash IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def put(self, page_hash: str, description: str):
+        """Grava (ou substitui) a descrição de uma página."""
+        self.put_many({page_hash: description})
+
+    def put_many(self, descriptions: Dict[str, str]):
+        """Grava várias descrições em uma única transação."""
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO descriptions (page_hash, description, created_at) VALUES (?, ?, ?)",
+                [(h, d, now) for h, d in descriptions.items()]
+            )
+            self._conn.commit()
+
+    def count(self) -> int:
+        """Número de descrições armazenadas."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM descriptions").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas do armazenamento (entradas, tamanho do arquivo, páginas livres)."""
+        with self._lock:
+            entries, total_chars = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(description)), 0) FROM descriptions"
+            ).fetchone()
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+            freelist = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return {
+            "entries": entries,
+            "total_description_chars": total_chars,
+            "file_size_bytes": os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0,
+            "reclaimable_bytes": freelist * page_size,
+        }
+
+    def compact(self):
+        """Aplica o WAL no arquivo principal e reconstrói o banco (VACUUM)."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("VACUUM")
+
+    def import_json_cache(self, cache_dir: str = "cache") -> int:
+        """
+        Importa os arquivos <page_hash>.json do cache antigo.
+        Entradas já existentes no armazenamento são mantidas. Retorna o número importado.
+
+        Atenção: essas entradas usam o esquema antigo de chave (nome do arquivo
+        e posição da página). Desde que a chave passou a ser o hash dos pixels
+        renderizados (compute_page_hash) elas não são mais encontradas pela
+        ingestão; a importação só preserva o conteúdo para consulta.
+        """
+        imported: Dict[str, str] = {}
+        for json_path in Path(cache_dir).glob("*.json"):
+            try:
+                with open(json_path, "r", encoding="utf-8") as f:
+                    imported[json_path.stem] = json.load(f)["description"]
+            except Exception as e:
+                logger.warning(f"Ignorando {json_path.name}: {e}")
+
+        existing = self.get_many(list(imported))
+        new_entries = {h: d for h, d in imported.items() if h not in existing}
+        if new_entries:
+            self.put_many(new_entries)
+        logger.info(f"📥 {len(new_entries)} descrições importadas de {cache_dir} "
+                    f"({len(imported) - len(new_entries)} já existentes)")
+        return len(new_entries)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    """
+    Linha de comando: estatísticas, compactação e importação do cache JSON
+    (entradas importadas têm chaves antigas e não são reaproveitadas na ingestão).
+    """
+    parser = argparse.ArgumentParser(description="Gerencia o armazenamento de descrições visuais.")
+    parser.add_argument("command", choices=["stats", "compact", "import"])
+    parser.add_argument("--db", default="cache/descriptions.sqlite", help="Arquivo SQLite das descrições")
+    parser.add_argument("--cache-dir", default="cache", help="Diretório com os arquivos JSON antigos")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = DescriptionStore(args.db)
+
+    if args.command == "import":
+        store.import_json_cache(args.cache_dir)
+    elif args.command == "compact":
+        before = store.stats()["file_size_bytes"]
+        store.compact()
+        after = store.stats()["file_size_bytes"]
+        print(f"🗜️ Compactado: {before / 1024:.1f} KB -> {after / 1024:.1f} KB")
+
+    stats = store.stats()
+    print(f"📊 Descrições: {stats['entries']}")
+    print(f"   Caracteres: {stats['total_description_chars']}")
+    print(f"   Arquivo: {stats['file_size_bytes'] / 1024:.1f} KB "
+          f"({stats['reclaimable_bytes'] / 1024:.1f} KB recuperáveis)")
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,13 +3,18 @@ import os
 import sys
 from pathlib import Path
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Callable
+from datetime import datetime
 import base64
 import io
 import hashlib
 import json
 from dotenv import load_dotenv
 import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # Carrega as variáveis de ambiente do arquivo .env
 load_dotenv()
@@ -24,24 +29,6 @@ if not api_key:
 else:
     print(f"✅ OPENAI_API_KEY encontrada: {api_key[:10]}...")
 
-# Criar função de retry simples (sem dependência externa)
-def retry_with_exponential_backoff(max_retries=3, base_delay=1):
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    if attempt == max_retries - 1:
-                        raise e
-                    delay = base_delay * (2 ** attempt)
-                    print(f"Erro na tentativa {attempt + 1}: {e}")
-                    print(f"Tentando novamente em {delay}s...")
-                    time.sleep(delay)
-            return None
-        return wrapper
-    return decorator
-
 # Tentar importar dependências.
 try:
     from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -50,12 +37,27 @@ try:
     from openai import OpenAI
     import fitz  # PyMuPDF
     from PIL import Image
+    import tiktoken
+    from embedding_cache import EmbeddingCache, content_hash
+    from description_store import DescriptionStore
+    from dedup import NearDuplicateFilter, DEDUP_THRESHOLD
+    from bm25_index import build_bm25_index, delete_bm25_index
+    from page_render import (
+        VISION_MODEL, VISION_MAX_TOKENS, VISION_PROMPT, VISION_CACHE_VERSION,
+        DEFAULT_IMAGE_OPTIONS, IMAGE_MIME_TYPES, VISUAL_TEXT_COVERAGE_THRESHOLD,
+        compute_page_hash, encode_image_to_base64, classify_page_visual_content, locate_figure_regions,
+        render_page_image, extract_page_tables, _extract_page_payload, _render_page_payload, init_render_worker
+    )
+    from utils import rate_limited_http_client, retry_with_exponential_backoff
+    from collection_alias import (
+        new_collection_version, promote_collection, resolve_collection_name, mark_collection_updated
+    )
     
     print("✅ Todas as dependências importadas com sucesso!")
 except ImportError as e:
     print(f"❌ Erro ao importar dependências: {e}")
     print("Por favor, execute:")
-    print("pip install langchain-text-splitters chromadb openai PyMuPDF Pillow python-dotenv")
+    print("pip install langchain-text-splitters chromadb openai PyMuPDF Pillow python-dotenv tiktoken")
     sys.exit(1)
 
 # Configuração de logging
@@ -67,71 +69,82 @@ logger = logging.getLogger(__name__)
 
 # Configuração da API OpenAI
 try:
-    client_openai = OpenAI(api_key=api_key)
+    # Chamadas de visão e de embeddings passam pelo limitador de taxa compartilhado
+    client_openai = OpenAI(api_key=api_key, http_client=rate_limited_http_client())
     print("✅ Cliente OpenAI inicializado")
 except Exception as e:
     print(f"❌ Erro ao inicializar cliente OpenAI: {e}")
     sys.exit(1)
 
+# Tempo máximo (s) de novas tentativas de uma chamada de visão ou de embeddings
+OPENAI_RETRY_DEADLINE = 300
+
 # Inicialização do cache
 CACHE_DIR = "cache"
 Path(CACHE_DIR).mkdir(exist_ok=True)
 
-def encode_image_to_base64(image: Image.Image) -> str:
-    """Converte um objeto de imagem PIL para uma string Base64."""
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+# Modelo de embedding e cache local de vetores
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536
+embedding_cache = EmbeddingCache(str(Path(CACHE_DIR) / "embeddings.sqlite"))
 
-@retry_with_exponential_backoff(max_retries=3, base_delay=2)
-def describe_image_with_openai(image_base64: str, page_hash: str) -> str:
+# Descrições visuais em um único arquivo indexado (substitui cache/<page_hash>.json;
+# a importação manual fica em "python description_store.py import")
+description_store = DescriptionStore(str(Path(CACHE_DIR) / "descriptions.sqlite"))
+
+# Bytes efetivamente enviados ao modelo de visão nesta execução
+upload_stats = {"images": 0, "bytes": 0}
+_upload_stats_lock = threading.Lock()
+
+@retry_with_exponential_backoff(initial_delay=2, max_retries=3, max_delay=30, deadline=OPENAI_RETRY_DEADLINE)
+def describe_image_with_openai(image_base64: str, page_hash: str, mime_type: str = "image/jpeg",
+                               detail: str = "high") -> str:
     """
     Usa a API da OpenAI (GPT-4o) para descrever o conteúdo de uma imagem com cache.
+    page_hash deve vir de compute_page_hash. Se a descrição não puder ser
+    gerada a exceção é propagada e nada é gravado no cache.
     """
-    cache_path = Path(CACHE_DIR) / f"{page_hash}.json"
-    
-    if cache_path.exists():
-        logger.info(f"  -> Usando cache para a página {page_hash[:8]}...")
-        try:
-            with open(cache_path, "r", encoding="utf-8") as f:
-                return json.load(f)["description"]
-        except Exception as e:
-            logger.warning(f"Erro ao ler cache, gerando nova descrição: {e}")
+    try:
+        cached_description = description_store.get(page_hash)
+        if cached_description is not None:
+            logger.info(f"  -> Usando cache para a página {page_hash[:8]}...")
+            return cached_description
+    except Exception as e:
+        logger.warning(f"Erro ao ler cache, gerando nova descrição: {e}")
 
     try:
-        logger.info(f"  -> Gerando descrição visual com OpenAI...")
+        image_bytes = len(image_base64) * 3 // 4
+        with _upload_stats_lock:
+            upload_stats["images"] += 1
+            upload_stats["bytes"] += image_bytes
+        logger.info(f"  -> Gerando descrição visual com OpenAI ({image_bytes / 1024:.1f} KB, detail={detail})...")
         response = client_openai.chat.completions.create(
-            model="gpt-4o",
+            model=VISION_MODEL,
             messages=[
                 {
                     "role": "user",
                     "content": [
                         {
                             "type": "text",
-                            "text": (
-                                "Descreva detalhadamente o conteúdo visual desta imagem, "
-                                "incluindo todos os gráficos, tabelas, diagramas e texto presente. "
-                                "Traduza o texto para português se necessário e resuma as informações-chave. "
-                                "A descrição deve ser o mais completa e objetiva possível para ser usada em um sistema de busca."
-                            )
+                            "text": VISION_PROMPT
                         },
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{mime_type};base64,{image_base64}",
+                                "detail": detail
                             },
                         },
                     ],
                 }
             ],
-            max_tokens=2048,
+            max_tokens=VISION_MAX_TOKENS,
         )
         description = response.choices[0].message.content
 
         # Salva a descrição no cache
         try:
-            with open(cache_path, "w", encoding="utf-8") as f:
-                json.dump({"description": description}, f, ensure_ascii=False)
+            description_store.put(page_hash, description)
             logger.info(f"  -> Descrição salva no cache")
         except Exception as e:
             logger.warning(f"Erro ao salvar cache: {e}")
@@ -139,37 +152,240 @@ def describe_image_with_openai(image_base64: str, page_hash: str) -> str:
         return description
     except Exception as e:
         logger.error(f"Erro ao descrever a imagem com OpenAI: {e}")
-        return "Não foi possível gerar uma descrição para esta imagem."
+        raise
+
+
+@retry_with_exponential_backoff(initial_delay=2, max_retries=3, max_delay=30, deadline=OPENAI_RETRY_DEADLINE)
+def _create_openai_embeddings(texts: List[str]) -> List[List[float]]:
+    """Chama a API de embeddings da OpenAI para uma lista de textos."""
+    response = client_openai.embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=texts,
+        dimensions=EMBEDDING_DIMENSIONS
+    )
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+def embed_texts_with_cache(texts: List[str]) -> List[List[float]]:
+    """
+    Gera embeddings consultando primeiro o cache local (hash do conteúdo +
+    modelo + dimensões); apenas os textos ausentes são enviados à API.
+    """
+    hashes = [content_hash(text) for text in texts]
+    cached = embedding_cache.get_many(hashes, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+
+    missing = {}
+    for h, text in zip(hashes, texts):
+        if h not in cached and h not in missing:
+            missing[h] = text
+
+    if missing:
+        vectors = _create_openai_embeddings(list(missing.values()))
+        new_vectors = dict(zip(missing.keys(), vectors))
+        embedding_cache.put_many(new_vectors, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+        cached.update(new_vectors)
 
+    logger.info(f"     Embeddings: {len(texts) - len(missing)} do cache, {len(missing)} via API")
+    return [cached[h] for h in hashes]
 
-def test_pdf_access(pdf_path: Path) -> bool:
-    """Testa se o PDF pode ser aberto e processado."""
+def open_pdf(pdf_path: Path):
+    """
+    Abre o PDF validando-o no mesmo passo (sem renderização de teste).
+    Retorna o documento aberto ou None se o arquivo não puder ser processado;
+    a responsabilidade de fechá-lo é de quem chama.
+    """
     try:
-        logger.info(f"🧪 Testando acesso ao PDF: {pdf_path}")
         doc = fitz.open(pdf_path)
-        page_count = doc.page_count
-        logger.info(f"✅ PDF acessível: {page_count} páginas")
-        
-        # Testar primeira página
-        if page_count > 0:
-            page = doc[0]
-            text = page.get_text()
-            logger.info(f"✅ Texto da primeira página extraído: {len(text)} caracteres")
-            
-            # Testar conversão de imagem
-            pix = page.get_pixmap(dpi=150)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            logger.info(f"✅ Imagem extraída: {img.width}x{img.height}")
-            
-        doc.close()
-        return True
     except Exception as e:
-        logger.error(f"❌ Erro ao testar PDF: {e}")
-        return False
+        logger.error(f"❌ Erro ao abrir PDF {pdf_path}: {e}")
+        return None
+    if doc.needs_pass or doc.page_count == 0:
+        logger.error(f"❌ PDF {pdf_path} {'protegido por senha' if doc.needs_pass else 'sem páginas'}")
+        doc.close()
+        return None
+    logger.info(f"  -> PDF aberto com sucesso: {doc.page_count} páginas")
+    return doc
 
-def load_and_process_multimodal_documents(data_path: str = "data") -> List[Dict[str, Any]]:
+def _describe_payload(payload: Dict[str, Any], cached_only: bool = False) -> List[Optional[str]]:
     """
-    Carrega PDFs, extrai texto e imagens, e gera descrições multimodais.
+    Gera uma descrição por imagem do payload (nenhuma para páginas textuais).
+    Imagens cuja descrição falhou ficam como None. Com cached_only=True as
+    descrições são apenas lidas do description_store (None se ausentes), sem
+    chamadas à API.
+    """
+    if cached_only:
+        cached = description_store.get_many([image["page_hash"] for image in payload["images"]])
+        return [cached.get(image["page_hash"]) for image in payload["images"]]
+
+    descriptions = []
+    for image in payload["images"]:
+        try:
+            descriptions.append(describe_image_with_openai(
+                image["img_base64"], image["page_hash"], image["mime_type"], image["detail"]
+            ))
+        except Exception as e:
+            logger.error(f"     ❌ Descrição visual da página {payload['page_num']} não gerada: {e}")
+            descriptions.append(None)
+    return descriptions
+
+def _build_page_document(pdf_path: Path, payload: Dict[str, Any], descriptions: List[Optional[str]]) -> Dict[str, Any]:
+    """
+    Monta o documento de página usado para o chunking. Além do conteúdo
+    completo, o documento traz as seções tipadas (chunk_type "text", "table" e
+    "visual") que são divididas e indexadas separadamente. Descrições que
+    falharam (None) não geram seção e são contadas em failed_descriptions,
+    para que o arquivo não seja registrado como concluído.
+    """
+    page_num = payload["page_num"]
+    text_content = payload["text_content"]
+    tables = payload.get("tables", [])
+    sections = []
+    if text_content.strip():
+        sections.append({"chunk_type": "text", "content": text_content})
+    for table_num, table in enumerate(tables, start=1):
+        sections.append({"chunk_type": "table", "content": table["markdown"],
+                         "section_label": f"Tabela {table_num}", "region": json.dumps(table["bbox"])})
+
+    figure_bboxes = [image["bbox"] for image in payload["images"] if image["bbox"] is not None]
+    if figure_bboxes:
+        for figure_num, (bbox, description) in enumerate(zip(figure_bboxes, descriptions), start=1):
+            if description is None:
+                continue
+            sections.append({"chunk_type": "visual", "content": description,
+                             "section_label": f"Figura {figure_num}", "region": json.dumps(bbox)})
+    elif descriptions and descriptions[0] is not None:
+        sections.append({"chunk_type": "visual", "content": descriptions[0],
+                         "section_label": "Gráficos, Imagens, etc."})
+
+    full_content = (
+        f"--- Conteúdo da Página {page_num} do arquivo '{pdf_path.name}' ---\n\n"
+        f"TEXTO DA PÁGINA:\n{text_content}\n\n"
+    )
+    for section in sections:
+        if section["chunk_type"] == "table":
+            full_content += f"TABELA ({section['section_label']}):\n{section['content']}\n\n"
+        elif section["chunk_type"] == "visual":
+            full_content += f"DESCRIÇÃO VISUAL ({section['section_label']}):\n{section['content']}\n\n"
+
+    metadata = {
+        "source": str(pdf_path),
+        "page": page_num,
+        "file_name": pdf_path.name,
+        "content_length": len(full_content),
+        "text_length": len(text_content),
+        "description_length": sum(len(d) for d in descriptions if d),
+        "table_count": len(tables),
+        **payload["visual"]
+    }
+    if figure_bboxes:
+        # Metadados do ChromaDB só aceitam valores escalares
+        metadata["figure_count"] = len(figure_bboxes)
+        metadata["figure_bboxes"] = json.dumps(figure_bboxes)
+
+    return {"content": full_content, "sections": sections, "metadata": metadata,
+            "failed_descriptions": descriptions.count(None)}
+
+def _iter_pdf_pages_serially(pdf_path: Path, doc, page_options: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Processa as páginas de um PDF uma a uma (modo original), entregando cada
+    página pronta. Usa o documento já aberto por open_pdf e o fecha ao terminar.
+    """
+    try:
+        for i, page in enumerate(doc):
+            page_num = i + 1
+            logger.info(f"  -> Processando página {page_num}/{doc.page_count}...")
+
+            try:
+                payload = _extract_page_payload(page, page_num, page_options)
+
+                # Gerar descrição das imagens
+                descriptions = _describe_payload(payload, page_options["cached_descriptions_only"])
+                logger.info(f"     Descrição gerada: {sum(len(d) for d in descriptions if d)} caracteres")
+
+                page_document = _build_page_document(pdf_path, payload, descriptions)
+                logger.info(f"     ✅ Página {page_num} processada com sucesso")
+
+            except Exception as e:
+                logger.error(f"     ❌ Erro na página {page_num}: {e}")
+                continue
+
+            yield page_document
+    finally:
+        doc.close()
+
+def _render_and_describe(render_future, cached_only: bool = False) -> Tuple[Dict[str, Any], List[Optional[str]]]:
+    """Aguarda a renderização de uma página e gera suas descrições (executada no pool de threads)."""
+    payload = render_future.result()
+    return payload, _describe_payload(payload, cached_only)
+
+def _iter_pdf_pages_concurrently(pdf_path: Path, page_count: int, render_pool: ProcessPoolExecutor,
+                                 describe_pool: ThreadPoolExecutor, page_options: Dict[str, Any],
+                                 max_in_flight: int) -> Iterator[Dict[str, Any]]:
+    """
+    Renderiza as páginas no pool de processos e descreve cada página renderizada
+    no pool de threads, com no máximo max_in_flight páginas em andamento.
+    As páginas são entregues na ordem original.
+    """
+
+    in_flight = deque()
+
+    def submit(page_index: int):
+        render_future = render_pool.submit(_render_page_payload, str(pdf_path), page_index, page_options)
+        in_flight.append((page_index + 1, describe_pool.submit(_render_and_describe, render_future,
+                                                               page_options["cached_descriptions_only"])))
+
+    next_index = 0
+    try:
+        while next_index < page_count and len(in_flight) < max_in_flight:
+            submit(next_index)
+            next_index += 1
+
+        while in_flight:
+            page_num, future = in_flight.popleft()
+            if next_index < page_count:
+                submit(next_index)
+                next_index += 1
+
+            try:
+                payload, descriptions = future.result()
+                page_document = _build_page_document(pdf_path, payload, descriptions)
+                logger.info(f"     ✅ Página {page_num}/{page_count} processada com sucesso")
+            except Exception as e:
+                logger.error(f"     ❌ Erro na página {page_num}: {e}")
+                continue
+
+            yield page_document
+    finally:
+        # Consumo interrompido: descartar o trabalho ainda não iniciado
+        for _page_num, future in in_flight:
+            future.cancel()
+
+def iter_multimodal_documents_by_file(data_path: str = "data", max_workers: int = 1,
+                                       max_concurrent_descriptions: Optional[int] = None,
+                                       pdf_files: Optional[List[Path]] = None,
+                                       text_coverage_threshold: Optional[float] = VISUAL_TEXT_COVERAGE_THRESHOLD,
+                                       figure_mode: bool = False,
+                                       table_mode: bool = True,
+                                       image_options: Optional[Dict[str, Any]] = None,
+                                       cached_descriptions_only: bool = False) -> Iterator[Tuple[Path, Iterator[Dict[str, Any]]]]:
+    """
+    Carrega PDFs, extrai texto e imagens, e gera descrições multimodais em
+    streaming: entrega (pdf_path, iterador de documentos de página) por arquivo.
+    O iterador de um arquivo deve ser consumido antes de avançar para o próximo;
+    só uma janela limitada de páginas fica em memória.
+
+    Com max_workers > 1 as páginas são renderizadas em um pool de processos e as
+    descrições visuais são geradas com até max_concurrent_descriptions chamadas
+    simultâneas (padrão: max_workers). A ordem das páginas e os metadados são
+    os mesmos do modo serial. pdf_files restringe o processamento a uma lista
+    de arquivos (padrão: todos os PDFs de data_path). text_coverage_threshold
+    ajusta o classificador de páginas textuais (None descreve todas as páginas;
+    veja classify_page_visual_content). Com figure_mode=True apenas as regiões
+    de figuras são recortadas e descritas, uma requisição por figura.
+    table_mode=True extrai as tabelas (page.find_tables) como seções próprias.
+    image_options sobrescreve DEFAULT_IMAGE_OPTIONS (formato, qualidade,
+    tons de cinza, detail, orçamento de bytes, tamanho e resolução máximos
+    das imagens enviadas). Com cached_descriptions_only=True nenhuma descrição
+    é gerada: as páginas usam apenas as descrições já em description_store.
     """
     logger.info(f"🔍 Verificando arquivos PDF em: {os.path.abspath(data_path)}")
     data_dir = Path(data_path)
@@ -178,98 +394,78 @@ def load_and_process_multimodal_documents(data_path: str = "data") -> List[Dict[
         logger.error(f"❌ Diretório não encontrado: {data_path}")
         logger.info(f"Criando diretório: {data_path}")
         data_dir.mkdir(parents=True, exist_ok=True)
-        return []
+        return
 
-    pdf_files = list(data_dir.glob("*.pdf"))
+    if pdf_files is None:
+        pdf_files = sorted(data_dir.glob("*.pdf"))
     logger.info(f"📁 Arquivos PDF encontrados: {len(pdf_files)}")
     for pdf in pdf_files:
         logger.info(f"  - {pdf.name} ({pdf.stat().st_size / 1024:.1f} KB)")
     
     if not pdf_files:
         logger.error(f"❌ Nenhum PDF encontrado em {data_path}")
-        return []
+        return
 
-    documents = []
-    total_pages = 0
-    
-    for pdf_path in pdf_files:
-        logger.info(f"\n📄 Processando o arquivo PDF: {pdf_path.name}")
-        
-        # Testar acesso ao PDF primeiro
-        if not test_pdf_access(pdf_path):
-            logger.error(f"❌ Pulando arquivo {pdf_path.name} devido a erro de acesso")
-            continue
-            
-        try:
-            doc = fitz.open(pdf_path)
-            logger.info(f"  -> PDF aberto com sucesso: {doc.page_count} páginas")
+    page_options = {
+        "text_coverage_threshold": text_coverage_threshold,
+        "figure_mode": figure_mode,
+        "table_mode": table_mode,
+        "image_options": {**DEFAULT_IMAGE_OPTIONS, **(image_options or {})},
+        "cached_descriptions_only": cached_descriptions_only,
+    }
+    concurrent = max_workers > 1
+    render_pool = None
+    describe_pool = None
+    if concurrent:
+        max_concurrent_descriptions = max_concurrent_descriptions or max_workers
+        logger.info(f"⚡ Modo concorrente: {max_workers} processos de renderização, "
+                    f"{max_concurrent_descriptions} descrições simultâneas")
+        # Os processos executam apenas page_render (sem os efeitos colaterais de importar este módulo)
+        render_pool = ProcessPoolExecutor(max_workers=max_workers, initializer=init_render_worker)
+        describe_pool = ThreadPoolExecutor(max_workers=max_concurrent_descriptions)
+
+    try:
+        for pdf_path in pdf_files:
+            logger.info(f"\n📄 Processando o arquivo PDF: {pdf_path.name}")
             
-            for i, page in enumerate(doc):
-                page_num = i + 1
-                logger.info(f"  -> Processando página {page_num}/{doc.page_count}...")
+            # A abertura valida o arquivo; o mesmo documento é usado no processamento serial
+            doc = open_pdf(pdf_path)
+            if doc is None:
+                logger.error(f"❌ Pulando arquivo {pdf_path.name} devido a erro de acesso")
+                continue
                 
-                try:
-                    # Extrair texto
-                    text_content = page.get_text()
-                    logger.info(f"     Texto extraído: {len(text_content)} caracteres")
-                    
-                    # Gerar hash da página
-                    page_data = f"{pdf_path.name}-page-{page_num}-{text_content[:100]}".encode('utf-8')
-                    page_hash = hashlib.sha256(page_data).hexdigest()
-                    
-                    # Extrair imagem da página
-                    logger.info(f"     Convertendo página para imagem...")
-                    pix = page.get_pixmap(dpi=200) 
-                    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-                    # Redimensionar se necessário
-                    max_size = 1024
-                    if img.width > max_size or img.height > max_size:
-                        logger.info(f"     Redimensionando imagem de {img.width}x{img.height}")
-                        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                    
-                    # Converter para base64
-                    img_base64 = encode_image_to_base64(img)
-                    logger.info(f"     Imagem convertida para base64: {len(img_base64)} caracteres")
-                    
-                    # Gerar descrição da imagem
-                    img_description = describe_image_with_openai(img_base64, page_hash)
-                    logger.info(f"     Descrição gerada: {len(img_description)} caracteres")
-
-                    # Combinar conteúdos
-                    full_content = (
-                        f"--- Conteúdo da Página {page_num} do arquivo '{pdf_path.name}' ---\n\n"
-                        f"TEXTO DA PÁGINA:\n{text_content}\n\n"
-                        f"DESCRIÇÃO VISUAL (Gráficos, Imagens, etc.):\n{img_description}\n"
-                    )
-                    
-                    documents.append({
-                        "content": full_content,
-                        "metadata": {
-                            "source": str(pdf_path),
-                            "page": page_num,
-                            "file_name": pdf_path.name,
-                            "content_length": len(full_content),
-                            "text_length": len(text_content),
-                            "description_length": len(img_description)
-                        }
-                    })
-                    
-                    total_pages += 1
-                    logger.info(f"     ✅ Página {page_num} processada com sucesso")
-                    
-                except Exception as e:
-                    logger.error(f"     ❌ Erro na página {page_num}: {e}")
-                    continue
-                    
-            doc.close()
+            if concurrent:
+                page_count = doc.page_count
+                doc.close()
+                pages = _iter_pdf_pages_concurrently(pdf_path, page_count, render_pool, describe_pool, page_options,
+                                                     max_in_flight=max_workers + max_concurrent_descriptions)
+            else:
+                pages = _iter_pdf_pages_serially(pdf_path, doc, page_options)
+            yield pdf_path, pages
+    finally:
+        if concurrent:
+            render_pool.shutdown(cancel_futures=True)
+            describe_pool.shutdown(cancel_futures=True)
+    
+    if upload_stats["images"]:
+        logger.info(f"   📤 {upload_stats['images']} imagens enviadas ao modelo de visão, "
+                    f"{upload_stats['bytes'] / 1024:.1f} KB no total "
+                    f"({upload_stats['bytes'] / upload_stats['images'] / 1024:.1f} KB por imagem)")
+
+def load_and_process_multimodal_documents(data_path: str = "data", **loader_options) -> List[Dict[str, Any]]:
+    """
+    Carrega PDFs, extrai texto e imagens, e gera descrições multimodais.
+    Aceita as mesmas opções de iter_multimodal_documents_by_file.
+    """
+    documents = []
+    for pdf_path, pages in iter_multimodal_documents_by_file(data_path, **loader_options):
+        try:
+            documents.extend(pages)
             logger.info(f"✅ Arquivo {pdf_path.name} processado completamente")
-            
         except Exception as e:
             logger.error(f"❌ Erro ao processar o arquivo {pdf_path.name}: {e}")
-            continue
     
-    logger.info(f"\n✅ RESUMO: {len(documents)} páginas processadas de {total_pages} páginas totais")
+    logger.info(f"\n✅ RESUMO: {len(documents)} páginas processadas")
     return documents
 
 def test_chromadb_connection(chroma_path: str, collection_name: str) -> bool:
@@ -285,10 +481,7 @@ def test_chromadb_connection(chroma_path: str, collection_name: str) -> bool:
         chroma_client = chromadb.PersistentClient(path=chroma_path)
         
         # Testar função de embedding
-        ef = embedding_functions.OpenAIEmbeddingFunction(
-            api_key=os.environ.get("OPENAI_API_KEY"),
-            model_name="text-embedding-3-small"
-        )
+        ef = _create_embedding_function()
         
         # Testar criação de coleção
         collection = chroma_client.get_or_create_collection(
@@ -296,15 +489,17 @@ def test_chromadb_connection(chroma_path: str, collection_name: str) -> bool:
             embedding_function=ef
         )
         
-        # Testar adição de documento
+        # Testar adição de documento (embeddings via cache: nenhuma chamada à API em execuções seguintes)
+        test_embeddings = embed_texts_with_cache(["Teste de conexão", "teste"])
         collection.add(
             documents=["Teste de conexão"],
+            embeddings=test_embeddings[:1],
             metadatas=[{"test": True}],
             ids=["test-id"]
         )
         
         # Testar consulta
-        results = collection.query(query_texts=["teste"], n_results=1)
+        results = collection.query(query_embeddings=test_embeddings[1:], n_results=1)
         
         # Limpar teste
         chroma_client.delete_collection(f"{collection_name}_test")
@@ -316,10 +511,399 @@ def test_chromadb_connection(chroma_path: str, collection_name: str) -> bool:
         logger.error(f"❌ Erro ao testar ChromaDB: {e}")
         return False
 
-def process_documents_to_chromadb(data_path: str = "data", chroma_path: str = "chroma_db", collection_name: str = "seade_gecon"):
+def compute_file_hash(file_path: Path) -> str:
+    """Calcula o sha256 do conteúdo de um arquivo em blocos."""
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def _write_json_atomic(path: Path, data: Dict[str, Any]):
+    """Grava um JSON de forma atômica (arquivo temporário + rename)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def _manifest_path(chroma_path: str, collection_name: str) -> Path:
+    """Caminho do manifesto de ingestão incremental de uma coleção."""
+    return Path(chroma_path) / f"{collection_name}_manifest.json"
+
+def load_manifest(chroma_path: str, collection_name: str) -> Dict[str, Any]:
+    """Carrega o manifesto (hash do arquivo e ids dos chunks por PDF)."""
+    manifest_path = _manifest_path(chroma_path, collection_name)
+    if not manifest_path.exists():
+        return {"files": {}}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Erro ao ler manifesto, reprocessando todos os arquivos: {e}")
+        return {"files": {}}
+
+def save_manifest(chroma_path: str, collection_name: str, manifest: Dict[str, Any]):
+    """Grava o manifesto de forma atômica."""
+    _write_json_atomic(_manifest_path(chroma_path, collection_name), manifest)
+
+def _checkpoint_path(chroma_path: str, collection_name: str) -> Path:
+    """Caminho do checkpoint de uma reconstrução completa em andamento."""
+    return Path(chroma_path) / f"{collection_name}_checkpoint.json"
+
+def load_checkpoint(chroma_path: str, collection_name: str) -> Optional[Dict[str, Any]]:
+    """Carrega o checkpoint da última reconstrução interrompida, se houver."""
+    checkpoint_path = _checkpoint_path(chroma_path, collection_name)
+    if not checkpoint_path.exists():
+        return None
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Erro ao ler checkpoint, iniciando do zero: {e}")
+        return None
+
+def save_checkpoint(chroma_path: str, collection_name: str, checkpoint: Dict[str, Any]):
+    """Grava o checkpoint de forma atômica."""
+    _write_json_atomic(_checkpoint_path(chroma_path, collection_name), checkpoint)
+
+# Pipeline de ingestão em streaming: páginas -> chunks -> lotes de embedding -> gravação.
+# As filas limitadas aplicam contrapressão, mantendo a memória independente do tamanho do corpus.
+PIPELINE_BATCH_SIZE = 50
+PIPELINE_QUEUE_SIZE = 4
+CHECKPOINT_MIN_INTERVAL = 5.0  # segundos entre gravações do checkpoint durante um arquivo
+_PIPELINE_DONE = object()
+
+# Chunks medidos em tokens do tokenizador do modelo de embedding (cl100k_base para
+# text-embedding-3-*), equivalentes aos antigos 4000/500 caracteres.
+TOKENIZER_ENCODING = "cl100k_base"
+CHUNK_SIZE_TOKENS = 1000
+CHUNK_OVERLAP_TOKENS = 125
+
+def _create_text_splitter():
+    """Cria o divisor de texto (por tokens) usado na ingestão."""
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name=TOKENIZER_ENCODING,
+        chunk_size=CHUNK_SIZE_TOKENS,
+        chunk_overlap=CHUNK_OVERLAP_TOKENS,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+def count_tokens(text: str) -> int:
+    """Número de tokens do texto no tokenizador do modelo de embedding."""
+    return len(tiktoken.get_encoding(TOKENIZER_ENCODING).encode(text, disallowed_special=()))
+
+SECTION_HEADERS = {
+    "text": "TEXTO DA PÁGINA",
+    "table": "TABELA",
+    "visual": "DESCRIÇÃO VISUAL",
+}
+
+def _split_page_into_chunks(doc: Dict[str, Any], text_splitter) -> List[Dict[str, Any]]:
+    """
+    Divide um documento de página em chunks com ids estáveis. Cada seção
+    tipada (texto, tabela, descrição visual) é dividida separadamente, de modo
+    que nenhum chunk mistura tipos; o tipo vai para os metadados (chunk_type).
+    O número de tokens de cada chunk também vai para os metadados (token_count),
+    permitindo montar o contexto da consulta sem tokenizar novamente.
+    """
+    metadata = doc['metadata']
+    # Documentos antigos, sem seções, são divididos pelo conteúdo completo. Uma
+    # lista vazia (página em branco, ou só com descrição que falhou) não gera chunks.
+    if 'sections' not in doc:
+        sections = [{"chunk_type": "text", "content": doc['content']}]
+    else:
+        sections = doc['sections']
+    if not sections:
+        return []
+    
+    pieces = []
+    for section_idx, section in enumerate(sections):
+        label = section.get("section_label")
+        header = (
+            f"--- {metadata['file_name']}, página {metadata['page']} - "
+            f"{SECTION_HEADERS[section['chunk_type']]}{f' ({label})' if label else ''} ---\n"
+        )
+        for chunk in text_splitter.split_text(section["content"]):
+            pieces.append((section_idx, section, header, chunk))
+    logger.info(f"     Gerados {len(pieces)} chunks")
+    
+    docs_to_embed = []
+    for chunk_idx, (section_idx, section, header, body) in enumerate(pieces):
+        chunk = header + body
+        chunk_id = f"{metadata['file_name']}-page{metadata['page']}-chunk{chunk_idx}"
+        chunk_metadata = {
+            **metadata,
+            "chunk_id": chunk_id,
+            "chunk_index": chunk_idx,
+            "total_chunks": len(pieces),
+            "chunk_type": section["chunk_type"],
+            "section_index": section_idx,
+            "token_count": count_tokens(chunk)
+        }
+        if section.get("region"):
+            chunk_metadata["region"] = section["region"]
+        
+        docs_to_embed.append({
+            "document": chunk,
+            "body": body,  # texto sem o cabeçalho, usado na deduplicação
+            "metadata": chunk_metadata,
+            "id": hashlib.sha256(chunk_id.encode()).hexdigest()
+        })
+    return docs_to_embed
+
+def _iter_chunk_batches(pages: Iterator[Dict[str, Any]], batch_size: int = PIPELINE_BATCH_SIZE,
+                        on_page: Optional[Callable[[Dict[str, Any]], None]] = None,
+                        deduplicator: Optional[NearDuplicateFilter] = None,
+                        on_duplicates: Optional[Callable[[List[Tuple[Dict[str, Any], Tuple[str, str]]]], None]] = None
+                        ) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Divide as páginas em chunks à medida que chegam e os agrupa em lotes de
+    embedding. Com um deduplicator, chunks quase duplicados de outros já vistos
+    são descartados antes do embedding e repassados a on_duplicates.
+    """
+    text_splitter = _create_text_splitter()
+    batch = []
+    for doc in pages:
+        if on_page:
+            on_page(doc)
+        try:
+            chunks = _split_page_into_chunks(doc, text_splitter)
+        except Exception as e:
+            logger.error(f"     ❌ Erro ao dividir documento: {e}")
+            continue
+        if deduplicator:
+            chunks, dropped = deduplicator.filter_chunks(chunks)
+            if dropped:
+                logger.info(f"     🧹 {len(dropped)} chunk(s) quase duplicado(s) descartado(s)")
+                if on_duplicates:
+                    on_duplicates(dropped)
+        batch.extend(chunks)
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    if batch:
+        yield batch
+
+def _stream_chunks_to_collection(collection, batches: Iterator[List[Dict[str, Any]]], upsert: bool = True,
+                                 on_batch_start: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+                                 on_batch_written: Optional[Callable[[List[Dict[str, Any]]], None]] = None) -> List[str]:
+    """
+    Grava os lotes na coleção em streaming: uma thread gera os embeddings (via
+    embed_texts_with_cache) e outra grava na coleção, ligadas por filas
+    limitadas. on_batch_start/on_batch_written são chamados na thread de
+    gravação antes e depois de cada lote. Retorna os ids dos chunks que falharam.
+    """
+    embed_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    write_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    failed_ids = []
+    counters = {"batches": 0, "chunks": 0}
+
+    def embed_stage():
+        while True:
+            batch_docs = embed_queue.get()
+            if batch_docs is _PIPELINE_DONE:
+                write_queue.put(_PIPELINE_DONE)
+                return
+            try:
+                embeddings = embed_texts_with_cache([d['document'] for d in batch_docs])
+            except Exception as e:
+                logger.error(f"     ❌ Erro ao gerar embeddings do lote: {e}")
+                failed_ids.extend(d['id'] for d in batch_docs)
+                continue
+            write_queue.put((batch_docs, embeddings))
+
+    def write_stage():
+        write = collection.upsert if upsert else collection.add
+        while True:
+            item = write_queue.get()
+            if item is _PIPELINE_DONE:
+                return
+            batch_docs, embeddings = item
+            try:
+                if on_batch_start:
+                    on_batch_start(batch_docs)
+                write(
+                    documents=[d['document'] for d in batch_docs],
+                    embeddings=embeddings,
+                    metadatas=[d['metadata'] for d in batch_docs],
+                    ids=[d['id'] for d in batch_docs]
+                )
+                counters["batches"] += 1
+                counters["chunks"] += len(batch_docs)
+                logger.info(f"     ✅ Lote {counters['batches']} gravado ({counters['chunks']} chunks até agora)")
+                if on_batch_written:
+                    on_batch_written(batch_docs)
+            except Exception as e:
+                logger.error(f"     ❌ Erro ao gravar lote: {e}")
+                failed_ids.extend(d['id'] for d in batch_docs)
+
+    embed_thread = threading.Thread(target=embed_stage, name="ingest-embed", daemon=True)
+    write_thread = threading.Thread(target=write_stage, name="ingest-write", daemon=True)
+    embed_thread.start()
+    write_thread.start()
+
+    try:
+        for batch_docs in batches:
+            embed_queue.put(batch_docs)
+    finally:
+        embed_queue.put(_PIPELINE_DONE)
+        embed_thread.join()
+        write_thread.join()
+
+    logger.info(f"🧮 Cache de embeddings: {embedding_cache.hits} acertos, {embedding_cache.misses} faltas")
+    return failed_ids
+
+def _new_file_progress(file_hash: str) -> Dict[str, Any]:
+    """Registro de progresso de um PDF (unidade de checkpoint)."""
+    return {
+        "sha256": file_hash,
+        "pages_described": 0,
+        "chunks_embedded": 0,
+        "batches_written": 0,
+        "chunk_ids": [],
+        "duplicates_dropped": 0,
+        "duplicate_of_files": [],
+        "failed_descriptions": 0,
+        "completed": False
+    }
+
+def _ingest_file_pages(collection, pdf_path: Path, pages: Iterator[Dict[str, Any]], progress: Dict[str, Any],
+                       save_progress: Callable[[], None], deduplicator: Optional[NearDuplicateFilter] = None):
+    """
+    Passa as páginas de um PDF pelo pipeline em streaming, atualizando progress
+    e persistindo-o com save_progress (no máximo a cada CHECKPOINT_MIN_INTERVAL
+    segundos, e sempre ao fim do arquivo). O arquivo só é marcado como
+    concluído se todas as páginas forem lidas, todas as descrições visuais
+    geradas e todos os lotes gravados.
+    Chunks descartados pelo deduplicator são contados em progress, que também
+    registra de quais outros arquivos vinham os chunks mantidos no lugar deles.
+    """
+    last_save = [0.0]
+
+    def save_throttled():
+        if time.monotonic() - last_save[0] >= CHECKPOINT_MIN_INTERVAL:
+            save_progress()
+            last_save[0] = time.monotonic()
+
+    def on_page(doc: Dict[str, Any]):
+        progress["pages_described"] += 1
+        progress["failed_descriptions"] += doc.get("failed_descriptions", 0)
+
+    def on_duplicates(dropped: List[Tuple[Dict[str, Any], Tuple[str, str]]]):
+        progress["duplicates_dropped"] += len(dropped)
+        other_files = {file_name for _chunk, (_id, file_name) in dropped if file_name != pdf_path.name}
+        progress["duplicate_of_files"] = sorted(other_files.union(progress["duplicate_of_files"]))
+
+    def on_batch_start(batch_docs: List[Dict[str, Any]]):
+        # Os ids são registrados antes da gravação para que chunks parciais possam ser removidos
+        progress["chunk_ids"].extend(d['id'] for d in batch_docs)
+        save_throttled()
+
+    def on_batch_written(batch_docs: List[Dict[str, Any]]):
+        progress["chunks_embedded"] += len(batch_docs)
+        progress["batches_written"] += 1
+        save_throttled()
+
+    try:
+        failed_ids = _stream_chunks_to_collection(
+            collection,
+            _iter_chunk_batches(pages, on_page=on_page, deduplicator=deduplicator, on_duplicates=on_duplicates),
+            on_batch_start=on_batch_start,
+            on_batch_written=on_batch_written
+        )
+        progress["completed"] = not failed_ids and not progress["failed_descriptions"]
+        if progress["completed"]:
+            logger.info(f"✅ Arquivo {pdf_path.name} processado completamente")
+        else:
+            logger.warning(f"⚠️ Arquivo {pdf_path.name} incompleto ({progress['failed_descriptions']} descrição(ões) "
+                           f"e {len(failed_ids)} chunk(s) com falha); será reprocessado na próxima execução")
+    except Exception as e:
+        logger.error(f"❌ Erro ao processar o arquivo {pdf_path.name}: {e}")
+    finally:
+        save_progress()
+
+def _test_collection_query(collection):
+    """Executa uma consulta de teste na coleção e registra o resultado."""
+    logger.info(f"🧪 Testando consulta...")
+    test_results = collection.query(
+        query_embeddings=embed_texts_with_cache(["economia"]), 
+        n_results=1
+    )
+    
+    if test_results['documents']:
+        logger.info(f"   ✅ Consulta teste funcionou: {len(test_results['documents'][0])} resultado(s)")
+    else:
+        logger.warning(f"   ⚠️ Consulta teste não retornou resultados")
+
+def _build_lexical_index(collection, chroma_path: str):
+    """
+    Reconstrói o índice BM25 da versão da coleção. Uma falha não interrompe a
+    ingestão: sem índice, a consulta usa apenas a busca vetorial.
+    """
+    try:
+        build_bm25_index(collection, chroma_path)
+    except Exception as e:
+        logger.error(f"❌ Erro ao construir o índice BM25 de '{collection.name}': {e}")
+
+def _collection_exists(chroma_client, name: str) -> bool:
+    """Verifica se uma coleção existe no ChromaDB."""
+    try:
+        chroma_client.get_collection(name)
+        return True
+    except Exception:
+        return False
+
+def _create_embedding_function():
+    """Cria a função de embedding da OpenAI usada pelas coleções."""
+    return embedding_functions.OpenAIEmbeddingFunction(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        model_name=EMBEDDING_MODEL,
+        # Permite apontar para um servidor compatível (ex.: fake_openai_server.py)
+        api_base=os.environ.get("OPENAI_BASE_URL")
+    )
+
+def _seed_deduplicator(collection, deduplicator: NearDuplicateFilter, files: Dict[str, Dict[str, Any]]):
+    """Registra no deduplicator os chunks já gravados (PDFs concluídos antes de uma retomada)."""
+    for file_name, progress in files.items():
+        chunk_ids = progress.get("chunk_ids", [])
+        for i in range(0, len(chunk_ids), 500):
+            stored = collection.get(ids=chunk_ids[i:i + 500], include=["documents"])
+            for chunk_id, document in zip(stored["ids"], stored["documents"]):
+                # Remover o cabeçalho de arquivo/página, como em _split_page_into_chunks
+                body = document.split("\n", 1)[1] if document.startswith("--- ") and "\n" in document else document
+                deduplicator.check(body, chunk_id, file_name)
+
+def process_documents_to_chromadb(data_path: str = "data", chroma_path: str = "chroma_db", collection_name: str = "seade_gecon",
+                                  incremental: bool = False, keep_previous_versions: int = 1,
+                                  dedup_threshold: Optional[float] = DEDUP_THRESHOLD, **loader_options):
     """
     Processa documentos PDF multimodais e adiciona ao ChromaDB.
+
+    A reconstrução completa é feita em uma nova versão da coleção; só depois de
+    populada o alias collection_name passa a apontar para ela, mantendo
+    keep_previous_versions versões anteriores para rollback. O progresso é
+    registrado por PDF em um checkpoint: se a execução for interrompida, a
+    próxima retoma a mesma versão de staging a partir do último PDF concluído.
+
+    Chunks quase duplicados (similaridade MinHash >= dedup_threshold, entre
+    todos os PDFs) são descartados antes do embedding; dedup_threshold=None
+    desativa a deduplicação. Os PDFs são processados em ordem de nome, então
+    o chunk mantido é sempre o do primeiro arquivo.
+
+    Com incremental=True apenas PDFs novos ou alterados são reprocessados
+    (veja process_documents_incrementally). As demais opções (max_workers,
+    figure_mode, image_options, ...) são repassadas a iter_multimodal_documents_by_file.
     """
+    if incremental:
+        return process_documents_incrementally(
+            data_path=data_path,
+            chroma_path=chroma_path,
+            collection_name=collection_name,
+            dedup_threshold=dedup_threshold,
+            **loader_options
+        )
+
     print(f"\n🚀 INICIANDO PROCESSAMENTO DE DOCUMENTOS")
     print(f"📁 Diretório de dados: {os.path.abspath(data_path)}")
     print(f"🗄️ ChromaDB: {os.path.abspath(chroma_path)}")
@@ -330,115 +914,209 @@ def process_documents_to_chromadb(data_path: str = "data", chroma_path: str = "c
         logger.error("❌ Falha na conexão com ChromaDB. Abortando.")
         return
     
-    # Processar documentos
-    documents_raw = load_and_process_multimodal_documents(data_path)
-    if not documents_raw:
-        logger.warning("❌ Nenhum documento processado. Finalizando.")
-        return
+    pdf_files = sorted(Path(data_path).glob("*.pdf"))
+    file_hashes = {pdf.name: compute_file_hash(pdf) for pdf in pdf_files}
 
-    logger.info(f"\n📝 Dividindo documentos em chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=4000,
-        chunk_overlap=500,
-        separators=["\n\n", "\n", " ", ""]
-    )
-    
-    docs_to_embed = []
-    chunk_count = 0
+    logger.info(f"\n🗄️ Conectando ao ChromaDB...")
+    chroma_client = chromadb.PersistentClient(path=chroma_path)
+    ef = _create_embedding_function()
     
-    for doc_idx, doc in enumerate(documents_raw):
-        logger.info(f"  -> Processando documento {doc_idx + 1}/{len(documents_raw)}")
-        try:
-            chunks = text_splitter.split_text(doc['content'])
-            logger.info(f"     Gerados {len(chunks)} chunks")
-            
-            for chunk_idx, chunk in enumerate(chunks):
-                chunk_id = f"{doc['metadata']['file_name']}-page{doc['metadata']['page']}-chunk{chunk_idx}"
-                
-                docs_to_embed.append({
-                    "document": chunk,
-                    "metadata": {
-                        **doc['metadata'],
-                        "chunk_id": chunk_id,
-                        "chunk_index": chunk_idx,
-                        "total_chunks": len(chunks)
-                    },
-                    "id": hashlib.sha256(chunk_id.encode()).hexdigest()
-                })
-                chunk_count += 1
-                
-        except Exception as e:
-            logger.error(f"     ❌ Erro ao dividir documento: {e}")
-
-    logger.info(f"✅ Total de {len(docs_to_embed)} chunks prontos para embedding.")
-
-    try:
-        logger.info(f"\n🗄️ Conectando ao ChromaDB...")
-        chroma_client = chromadb.PersistentClient(path=chroma_path)
-        
-        ef = embedding_functions.OpenAIEmbeddingFunction(
-            api_key=os.environ.get("OPENAI_API_KEY"),
-            model_name="text-embedding-3-small"
-        )
-        
-        # Remover coleção existente se existir
-        try:
-            chroma_client.delete_collection(collection_name)
-            logger.info(f"  -> Coleção existente '{collection_name}' removida")
-        except:
-            pass
+    checkpoint = load_checkpoint(chroma_path, collection_name)
+    if checkpoint and _collection_exists(chroma_client, checkpoint["staging_collection"]):
+        # Retomar a versão de staging da execução interrompida
+        staging_name = checkpoint["staging_collection"]
+        collection = chroma_client.get_collection(name=staging_name, embedding_function=ef)
+        logger.info(f"♻️ Retomando a coleção de staging '{staging_name}' (iniciada em {checkpoint['started_at']})")
         
+        # Descartar o progresso de PDFs removidos, alterados ou incompletos desde a interrupção
+        for file_name, progress in list(checkpoint["files"].items()):
+            if file_hashes.get(file_name) != progress["sha256"] or not progress.get("completed"):
+                if progress["chunk_ids"]:
+                    collection.delete(ids=progress["chunk_ids"])
+                del checkpoint["files"][file_name]
+                logger.info(f"  -> Progresso de '{file_name}' descartado (arquivo removido, alterado ou incompleto)")
+    else:
+        # Construir uma nova versão da coleção sem tocar na versão ativa
+        staging_name = new_collection_version(collection_name)
         collection = chroma_client.create_collection(
-            name=collection_name, 
+            name=staging_name, 
             embedding_function=ef
         )
-        logger.info(f"  -> Coleção '{collection_name}' criada")
+        checkpoint = {
+            "staging_collection": staging_name,
+            "started_at": datetime.now().isoformat(),
+            "files": {}
+        }
+        logger.info(f"  -> Coleção de staging '{staging_name}' criada")
+
+    def save_progress():
+        save_checkpoint(chroma_path, collection_name, checkpoint)
+
+    save_progress()
+    
+    pending = [pdf for pdf in pdf_files if not checkpoint["files"].get(pdf.name, {}).get("completed")]
+    logger.info(f"📋 {len(pdf_files) - len(pending)} PDF(s) já concluído(s), {len(pending)} pendente(s)")
+    
+    deduplicator = NearDuplicateFilter(dedup_threshold) if dedup_threshold else None
+    if deduplicator and len(pending) < len(pdf_files):
+        _seed_deduplicator(collection, deduplicator,
+                           {name: p for name, p in checkpoint["files"].items() if p.get("completed")})
+    
+    try:
+        for pdf_path, pages in iter_multimodal_documents_by_file(data_path, pdf_files=pending, **loader_options):
+            progress = _new_file_progress(file_hashes[pdf_path.name])
+            checkpoint["files"][pdf_path.name] = progress
+            _ingest_file_pages(collection, pdf_path, pages, progress, save_progress, deduplicator=deduplicator)
+    except (Exception, KeyboardInterrupt):
+        logger.error(f"❌ Ingestão interrompida. O progresso foi salvo em "
+                     f"{_checkpoint_path(chroma_path, collection_name)}; execute novamente para retomar.")
+        raise
+    
+    try:
+        final_count = collection.count()
+        if final_count == 0:
+            logger.warning("❌ Nenhum documento processado. Finalizando.")
+            chroma_client.delete_collection(staging_name)
+            _checkpoint_path(chroma_path, collection_name).unlink(missing_ok=True)
+            return
         
-        # Adicionar documentos em lotes
-        batch_size = 50
-        total_batches = (len(docs_to_embed) + batch_size - 1) // batch_size
+        # Teste de consulta antes de publicar a nova versão
+        _test_collection_query(collection)
+        _build_lexical_index(collection, chroma_path)
         
-        logger.info(f"📦 Adicionando {len(docs_to_embed)} documentos em {total_batches} lotes...")
+        # Arquivos incompletos entram sem hash: a próxima atualização incremental
+        # os trata como alterados, removendo seus chunks e reprocessando-os
+        save_manifest(chroma_path, staging_name, {
+            "files": {
+                file_name: {"sha256": progress["sha256"] if progress["completed"] else None,
+                            "chunk_ids": progress["chunk_ids"],
+                            "duplicate_of_files": progress.get("duplicate_of_files", [])}
+                for file_name, progress in checkpoint["files"].items()
+            }
+        })
         
-        for i in range(0, len(docs_to_embed), batch_size):
-            batch_num = (i // batch_size) + 1
-            batch_docs = docs_to_embed[i:i + batch_size]
-            
-            logger.info(f"  -> Processando lote {batch_num}/{total_batches} ({len(batch_docs)} documentos)...")
-            
+        # Trocar o alias atomicamente e descartar versões fora da retenção
+        legacy_collection = collection_name if _collection_exists(chroma_client, collection_name) else None
+        expired = promote_collection(chroma_path, collection_name, staging_name,
+                                     keep_previous=keep_previous_versions,
+                                     legacy_collection=legacy_collection)
+        _checkpoint_path(chroma_path, collection_name).unlink(missing_ok=True)
+        for old_name in expired:
             try:
-                texts = [d['document'] for d in batch_docs]
-                metadatas = [d['metadata'] for d in batch_docs]
-                ids = [d['id'] for d in batch_docs]
-                
-                collection.add(
-                    documents=texts,
-                    metadatas=metadatas,
-                    ids=ids
-                )
-                logger.info(f"     ✅ Lote {batch_num} adicionado com sucesso")
-                
+                chroma_client.delete_collection(old_name)
+                logger.info(f"  -> Versão antiga '{old_name}' removida")
             except Exception as e:
-                logger.error(f"     ❌ Erro no lote {batch_num}: {e}")
-                continue
+                logger.warning(f"  -> Não foi possível remover '{old_name}': {e}")
+            _manifest_path(chroma_path, old_name).unlink(missing_ok=True)
+            delete_bm25_index(chroma_path, old_name)
         
-        # Verificar resultado final
-        final_count = collection.count()
         logger.info(f"\n🎉 PROCESSAMENTO CONCLUÍDO!")
         logger.info(f"   📊 Total de documentos na coleção: {final_count}")
+        logger.info(f"   🔀 '{collection_name}' -> '{staging_name}'")
+        if deduplicator:
+            deduplicator.log_report(PIPELINE_BATCH_SIZE)
         
-        # Teste de consulta
-        logger.info(f"🧪 Testando consulta...")
-        test_results = collection.query(
-            query_texts=["economia"], 
-            n_results=1
+    except Exception as e:
+        logger.error(f"❌ Erro ao processar ChromaDB: {e}")
+        raise
+
+def compare_with_manifest(pdf_files: List[Path], known_files: Dict[str, Any]
+                          ) -> Tuple[Dict[str, str], List[str], List[str], List[str]]:
+    """
+    Compara os PDFs com o manifesto. Retorna (hashes dos arquivos, novos,
+    alterados, removidos); os alterados incluem os PDFs cujos duplicados
+    dependiam de um arquivo removido ou alterado.
+    """
+    file_hashes = {pdf.name: compute_file_hash(pdf) for pdf in pdf_files}
+    added = [name for name in file_hashes if name not in known_files]
+    changed = [name for name in file_hashes
+               if name in known_files and known_files[name].get("sha256") != file_hashes[name]]
+    removed = [name for name in known_files if name not in file_hashes]
+    dependents = [
+        name for name in file_hashes
+        if name in known_files and name not in changed
+        and set(known_files[name].get("duplicate_of_files", [])) & set(removed + changed)
+    ]
+    if dependents:
+        logger.info(f"📋 {len(dependents)} PDF(s) dependente(s) de duplicados serão reprocessado(s)")
+        changed.extend(dependents)
+    return file_hashes, added, changed, removed
+
+def process_documents_incrementally(data_path: str = "data", chroma_path: str = "chroma_db", collection_name: str = "seade_gecon",
+                                    dedup_threshold: Optional[float] = DEDUP_THRESHOLD, **loader_options):
+    """
+    Atualiza a coleção existente usando o manifesto de hashes: reprocessa apenas
+    PDFs novos ou alterados, remove os chunks de PDFs excluídos ou alterados e
+    faz upsert dos novos chunks. A atualização é aplicada na versão ativa do
+    alias e o manifesto é salvo a cada PDF concluído, servindo de checkpoint.
+
+    A deduplicação aqui é feita dentro de cada PDF. PDFs cujos duplicados
+    foram descartados em favor de chunks de um arquivo removido ou alterado
+    (duplicate_of_files no manifesto) também são reprocessados, para não
+    perder esse conteúdo.
+    """
+    print(f"\n🚀 INICIANDO ATUALIZAÇÃO INCREMENTAL")
+    print(f"📁 Diretório de dados: {os.path.abspath(data_path)}")
+    print(f"🗄️ ChromaDB: {os.path.abspath(chroma_path)}")
+    print(f"📚 Coleção: {collection_name}")
+
+    data_dir = Path(data_path)
+    pdf_files = sorted(data_dir.glob("*.pdf")) if data_dir.exists() else []
+
+    active_name = resolve_collection_name(chroma_path, collection_name)
+    manifest = load_manifest(chroma_path, active_name)
+    known_files = manifest.setdefault("files", {})
+    file_hashes, added, changed, removed = compare_with_manifest(pdf_files, known_files)
+
+    logger.info(f"📋 Manifesto: {len(added)} novo(s), {len(changed)} alterado(s), "
+                f"{len(removed)} removido(s), {len(file_hashes) - len(added) - len(changed)} inalterado(s)")
+
+    if not added and not changed and not removed:
+        logger.info("✅ Nenhuma alteração detectada. Nada a fazer.")
+        return
+
+    # Testar ChromaDB primeiro
+    if not test_chromadb_connection(chroma_path, collection_name):
+        logger.error("❌ Falha na conexão com ChromaDB. Abortando.")
+        return
+
+    try:
+        chroma_client = chromadb.PersistentClient(path=chroma_path)
+        collection = chroma_client.get_or_create_collection(
+            name=active_name,
+            embedding_function=_create_embedding_function()
         )
-        
-        if test_results['documents']:
-            logger.info(f"   ✅ Consulta teste funcionou: {len(test_results['documents'][0])} resultado(s)")
-        else:
-            logger.warning(f"   ⚠️ Consulta teste não retornou resultados")
-        
+        logger.info(f"  -> Atualizando a versão ativa '{active_name}'")
+
+        # Remover chunks de arquivos excluídos ou alterados
+        for file_name in removed + changed:
+            stale_ids = known_files[file_name].get("chunk_ids", [])
+            if stale_ids:
+                collection.delete(ids=stale_ids)
+            logger.info(f"  -> {len(stale_ids)} chunks antigos de '{file_name}' removidos")
+            del known_files[file_name]
+            save_manifest(chroma_path, active_name, manifest)
+
+        to_process = [pdf for pdf in pdf_files if pdf.name in set(added + changed)]
+        if to_process:
+            for pdf_path, pages in iter_multimodal_documents_by_file(data_path, pdf_files=to_process, **loader_options):
+                progress = _new_file_progress(file_hashes[pdf_path.name])
+                deduplicator = NearDuplicateFilter(dedup_threshold) if dedup_threshold else None
+                _ingest_file_pages(collection, pdf_path, pages, progress, save_progress=lambda: None,
+                                   deduplicator=deduplicator)
+                if deduplicator:
+                    deduplicator.log_report(PIPELINE_BATCH_SIZE)
+                # Sem hash, um arquivo incompleto conta como alterado na próxima execução
+                known_files[pdf_path.name] = {"sha256": progress["sha256"] if progress["completed"] else None,
+                                              "chunk_ids": progress["chunk_ids"]}
+                save_manifest(chroma_path, active_name, manifest)
+
+        _build_lexical_index(collection, chroma_path)
+        mark_collection_updated(chroma_path, collection_name)
+
+        logger.info(f"\n🎉 ATUALIZAÇÃO INCREMENTAL CONCLUÍDA!")
+        logger.info(f"   📊 Total de documentos na coleção: {collection.count()}")
+
     except Exception as e:
         logger.error(f"❌ Erro ao processar ChromaDB: {e}")
         raise
@@ -477,4 +1155,4 @@ def main():
         logger.exception("Detalhes do erro:")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,169 @@
+# embedding_cache.py - Cache persistente de vetores de embedding
+import re
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(text: str) -> str:
+    """Hash sha256 do conteúdo de um chunk, usado como chave do cache."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Cache local (SQLite) de embeddings indexado por hash do conteúdo,
+    modelo e número de dimensões. Os vetores são armazenados como float32.
+    """
+
+    def __init__(self, db_path: str = "cache/embeddings.sqlite"):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                content_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                dimensions INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (content_hash, model, dimensions)
+            )
+            """
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, content_hashes: Sequence[str], model: str, dimensions: int) -> Dict[str, List[float]]:
+        """Busca vários vetores de uma vez. Retorna apenas os hashes encontrados."""
+        found: Dict[str, List[float]] = {}
+        unique_hashes = list(dict.fromkeys(content_hashes))
+        # SQLite limita o número de parâmetros por consulta
+        step = 500
+        with self._lock:
+            for i in range(0, len(unique_hashes), step):
+                chunk = unique_hashes[i:i + step]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT content_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND dimensions = ? AND content_hash IN ({placeholders})",
+                    [model, dimensions, *chunk]
+                ).fetchall()
+                for row_hash, blob in rows:
+                    found[row_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+            self.hits += sum(1 for h in content_hashes if h in found)
+            self.misses += sum(1 for h in content_hashes if h not in found)
+        return found
+
+    def put_many(self, vectors: Dict[str, Sequence[float]], model: str, dimensions: int):
+        """Grava vários vetores (hash do conteúdo -> vetor)."""
+        rows = [
+            (h, model, dimensions, np.asarray(vector, dtype=np.float32).tobytes())
+            for h, vector in vectors.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (content_hash, model, dimensions, vector) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def count(self) -> int:
+        """Número de vetores armazenados."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normaliza os espaços de uma consulta para uso como chave de cache. Maiúsculas
+    são mantidas: siglas como PIA, IPI e ABC mudam o embedding da consulta.
+    """
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class QueryEmbeddingCache:
+    """
+    Cache de embeddings de consultas: LRU em memória com expiração (TTL) e,
+    opcionalmente, uma camada em disco (EmbeddingCache) que sobrevive a
+    reinicializações. A chave é a consulta com os espaços normalizados, que é
+    também o texto enviado a compute.
+    """
+
+    def __init__(self, model: str, dimensions: Optional[int] = None, max_entries: int = 256,
+                 ttl_seconds: Optional[float] = 3600, disk_cache: Optional[EmbeddingCache] = None):
+        self.model = model
+        self.dimensions = dimensions or 0
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_cache = disk_cache
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _get_memory(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            vector, stored_at = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return vector
+
+    def _put_memory(self, key: str, vector: List[float]):
+        with self._lock:
+            self._entries[key] = (vector, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, query: str, compute: Callable[[str], List[float]]) -> List[float]:
+        """Retorna o embedding da consulta, chamando compute apenas em caso de falta."""
+        key = normalize_query(query)
+        vector = self._get_memory(key)
+        if vector is not None:
+            self.stats["hits"] += 1
+            return vector
+
+        if self.disk_cache is not None:
+            stored = self.disk_cache.get_many([content_hash(key)], self.model, self.dimensions)
+            if stored:
+                vector = stored[content_hash(key)]
+                self.stats["disk_hits"] += 1
+                self._put_memory(key, vector)
+                return vector
+
+        self.stats["misses"] += 1
+        vector = compute(key)
+        self._put_memory(key, vector)
+        if self.disk_cache is not None:
+            self.disk_cache.put_many({content_hash(key): vector}, self.model, self.dimensions)
+        return vector
+
+    def info(self) -> Dict[str, float]:
+        """Contadores de acertos/faltas e ocupação do cache em memória."""
+        lookups = sum(self.stats.values())
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "hit_rate": (self.stats["hits"] + self.stats["disk_hits"]) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,336 @@
+# fake_openai_server.py - Servidor HTTP local que imita a API da OpenAI (para testes sem custo)
+import sys
+import json
+import time
+import uuid
+import hashlib
+import logging
+import argparse
+import threading
+from collections import deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FAKE_DESCRIPTION = "Descrição simulada: página com gráficos e tabelas de indicadores econômicos."
+FAKE_ANSWER = "Resposta simulada com base nos documentos fornecidos."
+
+
+def fake_embedding(text: str, dimensions: int = 1536) -> list:
+    """Vetor determinístico derivado do hash do texto (mesmo texto, mesmo vetor)."""
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    values = []
+    counter = 0
+    while len(values) < dimensions:
+        block = hashlib.sha256(seed + counter.to_bytes(4, "little")).digest()
+        values.extend((b - 127.5) / 127.5 for b in block)
+        counter += 1
+    return values[:dimensions]
+
+
+class FakeOpenAIState:
+    """
+    Arquivos, lotes e contadores compartilhados pelas requisições do servidor.
+
+    latency simula o tempo de resposta (segundos) de chat e embeddings. rpm e
+    tpm, se informados, limitam requisições e tokens por minuto (janela
+    deslizante, por modelo): acima do limite o servidor responde 429 com os
+    mesmos cabeçalhos x-ratelimit-* / retry-after-ms da API real.
+    """
+
+    def __init__(self, batch_delay: float = 0.0, latency: float = 0.0,
+                 rpm: Optional[int] = None, tpm: Optional[int] = None):
+        self.batch_delay = batch_delay
+        self.latency = latency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self._windows: Dict[str, deque] = {}
+        self.stats = {"requests": 0, "chat_calls": 0, "embedding_calls": 0,
+                      "embedding_inputs": 0, "bytes_received": 0, "rate_limited": 0}
+
+    def add_file(self, content: bytes) -> str:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        with self.lock:
+            self.files[file_id] = content
+        return file_id
+
+    def check_rate_limit(self, model: str, tokens: int) -> Tuple[bool, Dict[str, str]]:
+        """
+        Registra a requisição na janela de 60s do modelo. Retorna (permitida,
+        cabeçalhos de limite); requisições recusadas não consomem a cota.
+        """
+        if self.rpm is None and self.tpm is None:
+            return True, {}
+        now = time.monotonic()
+        with self.lock:
+            window = self._windows.setdefault(model, deque())
+            while window and now - window[0][0] >= 60:
+                window.popleft()
+            used_tokens = sum(t for _ts, t in window)
+            reset = 60 - (now - window[0][0]) if window else 0.0
+
+            allowed = ((self.rpm is None or len(window) < self.rpm)
+                       and (self.tpm is None or used_tokens + tokens <= self.tpm))
+            if allowed:
+                window.append((now, tokens))
+                used_tokens += tokens
+            else:
+                self.stats["rate_limited"] += 1
+
+        headers = {}
+        if self.rpm is not None:
+            headers["x-ratelimit-limit-requests"] = str(self.rpm)
+            headers["x-ratelimit-remaining-requests"] = str(max(0, self.rpm - len(window)))
+            headers["x-ratelimit-reset-requests"] = f"{reset:.3f}s"
+        if self.tpm is not None:
+            headers["x-ratelimit-limit-tokens"] = str(self.tpm)
+            headers["x-ratelimit-remaining-tokens"] = str(max(0, self.tpm - used_tokens))
+            headers["x-ratelimit-reset-tokens"] = f"{reset:.3f}s"
+        if not allowed:
+            headers["retry-after-ms"] = str(int(max(reset, 0.05) * 1000))
+        return allowed, headers
+
+
+def chat_completion_response(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Resposta no formato de chat.completions."""
+    has_image = any(
+        isinstance(message.get("content"), list)
+        and any(part.get("type") == "image_url" for part in message["content"])
+        for message in body.get("messages", [])
+    )
+    content = FAKE_DESCRIPTION if has_image else FAKE_ANSWER
+    prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                  "total_tokens": prompt_tokens + len(content) // 4}
+    }
+
+
+def embeddings_response(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Resposta no formato de embeddings."""
+    inputs = body.get("input", [])
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dimensions = body.get("dimensions") or 1536
+    total_tokens = sum(len(text) // 4 for text in inputs)
+    return {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": i, "embedding": fake_embedding(text, dimensions)}
+            for i, text in enumerate(inputs)
+        ],
+        "model": body.get("model", "text-embedding-3-small"),
+        "usage": {"prompt_tokens": total_tokens, "total_tokens": total_tokens}
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Implementa o subconjunto da API usado pelo projeto (chat, embeddings, files e batches)."""
+
+    server_version = "FakeOpenAI/1.0"
+    state: FakeOpenAIState = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        with self.state.lock:
+            self.state.stats["requests"] += 1
+            self.state.stats["bytes_received"] += len(body)
+        return body
+
+    def _send_json(self, payload: Dict[str, Any], status: int = 200, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_bytes(self, data: bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _path(self) -> str:
+        path = self.path.split("?", 1)[0]
+        return path[3:] if path.startswith("/v1") else path
+
+    def do_POST(self):
+        body = self._read_body()
+        path = self._path()
+
+        if path in ("/chat/completions", "/embeddings"):
+            request = json.loads(body)
+            allowed, headers = self.state.check_rate_limit(request.get("model", ""), len(body) // 4)
+            if not allowed:
+                return self._send_json(
+                    {"error": {"message": "Rate limit reached (servidor falso)", "type": "requests",
+                               "code": "rate_limit_exceeded"}},
+                    status=429, headers=headers
+                )
+            if self.state.latency:
+                time.sleep(self.state.latency)
+
+            if path == "/chat/completions":
+                with self.state.lock:
+                    self.state.stats["chat_calls"] += 1
+                return self._send_json(chat_completion_response(request), headers=headers)
+
+            with self.state.lock:
+                self.state.stats["embedding_calls"] += 1
+                inputs = request.get("input", [])
+                self.state.stats["embedding_inputs"] += 1 if isinstance(inputs, str) else len(inputs)
+            return self._send_json(embeddings_response(request), headers=headers)
+
+        if path == "/files":
+            return self._upload_file(body)
+
+        if path == "/batches":
+            return self._create_batch(json.loads(body))
+
+        if path.startswith("/batches/") and path.endswith("/cancel"):
+            batch = self.state.batches.get(path.split("/")[2])
+            if not batch:
+                return self._send_json({"error": {"message": "batch not found"}}, status=404)
+            batch["status"] = "cancelled"
+            return self._send_json(batch)
+
+        self._send_json({"error": {"message": f"rota desconhecida: {path}"}}, status=404)
+
+    def do_GET(self):
+        self._read_body()
+        path = self._path()
+
+        if path.startswith("/batches/"):
+            batch = self.state.batches.get(path.split("/")[2])
+            if not batch:
+                return self._send_json({"error": {"message": "batch not found"}}, status=404)
+            if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.state.batch_delay:
+                self._complete_batch(batch)
+            return self._send_json(batch)
+
+        if path.startswith("/files/") and path.endswith("/content"):
+            content = self.state.files.get(path.split("/")[2])
+            if content is None:
+                return self._send_json({"error": {"message": "file not found"}}, status=404)
+            return self._send_bytes(content)
+
+        self._send_json({"error": {"message": f"rota desconhecida: {path}"}}, status=404)
+
+    def _upload_file(self, body: bytes):
+        """Recebe um upload multipart/form-data (campo 'file')."""
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8") + body
+        )
+        content = b""
+        filename = "upload.jsonl"
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "file":
+                content = part.get_payload(decode=True) or b""
+                filename = part.get_filename() or filename
+        file_id = self.state.add_file(content)
+        self._send_json({
+            "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": filename, "purpose": "batch", "status": "processed"
+        })
+
+    def _create_batch(self, request: Dict[str, Any]):
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": batch_id, "object": "batch", "endpoint": request.get("endpoint"),
+            "input_file_id": request.get("input_file_id"), "completion_window": request.get("completion_window", "24h"),
+            "status": "in_progress", "output_file_id": None, "error_file_id": None,
+            "created_at": int(time.time()),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0}
+        }
+        with self.state.lock:
+            self.state.batches[batch_id] = batch
+        self._send_json(batch)
+
+    def _complete_batch(self, batch: Dict[str, Any]):
+        """Processa todas as requisições do lote e gera o arquivo de saída."""
+        lines = self.state.files.get(batch["input_file_id"], b"").decode("utf-8").splitlines()
+        output = []
+        for line in lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            if request["url"].endswith("/embeddings"):
+                response_body = embeddings_response(request["body"])
+            else:
+                response_body = chat_completion_response(request["body"])
+            output.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:16]}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": response_body},
+                "error": None
+            }))
+        batch["output_file_id"] = self.state.add_file(("\n".join(output) + "\n").encode("utf-8"))
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+        batch["request_counts"] = {"total": len(output), "completed": len(output), "failed": 0}
+
+
+def start_fake_server(host: str = "127.0.0.1", port: int = 0, batch_delay: float = 0.0, latency: float = 0.0,
+                      rpm: Optional[int] = None, tpm: Optional[int] = None):
+    """
+    Inicia o servidor em uma thread. Retorna (server, base_url); use
+    server.shutdown() para encerrar e server.RequestHandlerClass.state.stats
+    para os contadores. latency, rpm e tpm: veja FakeOpenAIState.
+    """
+    state = FakeOpenAIState(batch_delay, latency=latency, rpm=rpm, tpm=tpm)
+    handler = type("BoundFakeOpenAIHandler", (FakeOpenAIHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    base_url = f"http://{server.server_address[0]}:{server.server_address[1]}/v1"
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita a API da OpenAI.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="Segundos até um lote ser concluído")
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos de latência simulada por requisição")
+    parser.add_argument("--rpm", type=int, default=None, help="Limite de requisições por minuto (por modelo)")
+    parser.add_argument("--tpm", type=int, default=None, help="Limite de tokens por minuto (por modelo)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server, base_url = start_fake_server(args.host, args.port, args.batch_delay,
+                                         latency=args.latency, rpm=args.rpm, tpm=args.tpm)
+    print(f"🧪 Servidor OpenAI falso em {base_url}")
+    print(f"   Use OPENAI_BASE_URL={base_url} OPENAI_API_KEY=sk-fake")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,8 @@ import sys
 
 # Importa a função de processamento de documentos
 from embedding import process_documents_to_chromadb
+from collection_alias import rollback_collection
+from dedup import DEDUP_THRESHOLD
 
 # Caminho do arquivo Streamlit
 streamlit_file = "streamlit_app.py"
@@ -19,18 +21,46 @@ def run_streamlit():
     except Exception as e:
         print(f"Erro ao executar Streamlit: {e}")
 
+def get_int_arg(name: str, default: int) -> int:
+    """Lê um argumento inteiro no formato '--nome N' da linha de comando."""
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        try:
+            return int(sys.argv[index + 1])
+        except (IndexError, ValueError):
+            print(f"⚠️ Valor inválido para {name}, usando {default}.")
+    return default
+
 def main():
     """Função principal que gerencia o fluxo do programa."""
     
+    # Reverte o alias da coleção para a versão anterior
+    if "--rollback" in sys.argv:
+        target = rollback_collection("chroma_db", "seade_gecon")
+        if target:
+            print(f"↩️ Coleção 'seade_gecon' revertida para '{target}'")
+        else:
+            print("⚠️ Nenhuma versão anterior disponível para rollback.")
+        return
+
     # Verifica se a base de dados precisa ser populada
     if "--populate" in sys.argv:
         print("\n🚀 Iniciando a criação da base de dados vetorial...")
         try:
-            # Chama a função do seu arquivo embedding.py
-            process_documents_to_chromadb(
+            # Chama a função do seu arquivo embedding.py (ou a ingestão via Batch API)
+            populate = process_documents_to_chromadb
+            if "--batch" in sys.argv:
+                from batch_ingest import run_batch_ingestion
+                populate = run_batch_ingestion
+            populate(
                 data_path="data", 
                 chroma_path="chroma_db", 
-                collection_name="seade_gecon"
+                collection_name="seade_gecon",
+                max_workers=get_int_arg("--workers", 1),
+                incremental="--incremental" in sys.argv,
+                figure_mode="--figures" in sys.argv,
+                table_mode="--no-tables" not in sys.argv,
+                dedup_threshold=None if "--no-dedup" in sys.argv else DEDUP_THRESHOLD
             )
             print("✅ Base de dados criada/atualizada com sucesso!")
         except Exception as e:
@@ -44,4 +74,4 @@ def main():
         run_streamlit()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
\ No newline at end of file
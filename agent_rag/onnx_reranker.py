@@ -0,0 +1,144 @@
+# onnx_reranker.py - Cross-encoder em ONNX Runtime (int8) com fallback para PyTorch
+import re
+import logging
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ONNX_CACHE_DIR = "cache/onnx_reranker"
+RERANKER_BACKENDS = ("auto", "onnx", "onnx-fp32", "torch")
+
+
+def _model_dir(model_name: str, cache_dir: str) -> Path:
+    return Path(cache_dir) / re.sub(r"[^\w.-]+", "__", model_name)
+
+
+def export_cross_encoder(model_name: str, cache_dir: str = ONNX_CACHE_DIR, quantize: bool = True,
+                         opset: int = 14) -> Path:
+    """
+    Exporta o cross-encoder do Hugging Face para ONNX (eixos de lote e
+    sequência dinâmicos) e, com quantize=True, gera a versão com quantização
+    dinâmica int8 dos pesos. Os arquivos ficam em cache; retorna o modelo pedido.
+    """
+    model_dir = _model_dir(model_name, cache_dir)
+    fp32_path = model_dir / "model.onnx"
+    int8_path = model_dir / "model.int8.onnx"
+    target = int8_path if quantize else fp32_path
+    if target.exists():
+        return target
+
+    model_dir.mkdir(parents=True, exist_ok=True)
+    if not fp32_path.exists():
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+        logger.info(f"📦 Exportando '{model_name}' para ONNX...")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+        sample = tokenizer(["consulta de exemplo"], ["documento de exemplo para exportação"],
+                           padding=True, truncation="longest_first", return_tensors="pt")
+        input_names = list(sample.keys())
+        tmp_path = fp32_path.with_suffix(".onnx.tmp")
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (dict(sample),),
+                str(tmp_path),
+                input_names=input_names,
+                output_names=["logits"],
+                dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in input_names},
+                              "logits": {0: "batch"}},
+                opset_version=opset,
+            )
+        tokenizer.save_pretrained(model_dir)
+        tmp_path.replace(fp32_path)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        logger.info("🗜️ Aplicando quantização dinâmica int8...")
+        tmp_path = int8_path.with_suffix(".onnx.tmp")
+        quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+        tmp_path.replace(int8_path)
+    return target
+
+
+class OnnxCrossEncoder:
+    """
+    Cross-encoder executado no ONNX Runtime (CPU), com a mesma interface de
+    predict do CrossEncoder do sentence-transformers. intra_op_threads limita
+    as threads usadas por inferência (None: padrão do ONNX Runtime).
+    """
+
+    def __init__(self, model_name: str, quantize: bool = True, intra_op_threads: Optional[int] = None,
+                 max_length: int = 512, cache_dir: str = ONNX_CACHE_DIR):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = export_cross_encoder(model_name, cache_dir=cache_dir, quantize=quantize)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(str(model_path), sess_options=options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path.parent)
+        self.max_length = max_length
+        self.backend = "onnx-int8" if quantize else "onnx-fp32"
+
+    def predict(self, sentences: Sequence[Sequence[str]], batch_size: int = 32,
+                show_progress_bar: bool = False, **_kwargs) -> np.ndarray:
+        """
+        Pontua pares [consulta, documento]. Com um único logit por par aplica a
+        sigmoide, como o CrossEncoder do sentence-transformers: as pontuações
+        ficam na mesma escala (0 a 1) em qualquer backend.
+        """
+        scores: List[np.ndarray] = []
+        for i in range(0, len(sentences), batch_size):
+            batch = sentences[i:i + batch_size]
+            encoded = self.tokenizer(
+                [pair[0] for pair in batch], [pair[1] for pair in batch],
+                padding=True, truncation="longest_first", max_length=self.max_length, return_tensors="np"
+            )
+            feeds = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+            logits = self.session.run(["logits"], feeds)[0]
+            if logits.ndim == 1 or logits.shape[1] == 1:
+                logits = 1 / (1 + np.exp(-logits.reshape(-1)))
+            scores.append(logits)
+        return np.concatenate(scores) if scores else np.array([], dtype=np.float32)
+
+
+def load_reranker(model_name: str, backend: str = "auto", intra_op_threads: Optional[int] = None):
+    """
+    Carrega o reranker no backend pedido:
+      - "onnx": ONNX Runtime com pesos int8;
+      - "onnx-fp32": ONNX Runtime sem quantização;
+      - "torch": CrossEncoder do sentence-transformers (PyTorch fp32);
+      - "auto": tenta "onnx" e recorre a "torch" em caso de erro.
+    """
+    if backend not in RERANKER_BACKENDS:
+        raise ValueError(f"Backend de reranker desconhecido: {backend} (opções: {', '.join(RERANKER_BACKENDS)})")
+
+    if backend in ("auto", "onnx", "onnx-fp32"):
+        try:
+            reranker = OnnxCrossEncoder(model_name, quantize=backend != "onnx-fp32",
+                                        intra_op_threads=intra_op_threads)
+            logger.info(f"✅ Reranker carregado no ONNX Runtime ({reranker.backend}).")
+            return reranker
+        except Exception as e:
+            if backend != "auto":
+                raise
+            logger.warning(f"ONNX Runtime indisponível para o reranker, usando PyTorch. Erro: {e}")
+
+    from sentence_transformers import CrossEncoder
+    if intra_op_threads:
+        import torch
+        torch.set_num_threads(intra_op_threads)
+    reranker = CrossEncoder(model_name)
+    reranker.backend = "torch"
+    return reranker
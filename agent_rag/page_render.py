@@ -0,0 +1,334 @@
+# page_render.py - Renderização e extração de páginas PDF
+#
+# Sem efeitos colaterais na importação (nenhuma chave de API, cliente ou cache):
+# é o ponto de entrada dos processos de renderização, que com o método "spawn"
+# (Windows, macOS) importam o módulo da função executada.
+import io
+import base64
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Modelo e prompt das descrições visuais. Fazem parte da chave do cache:
+# alterar qualquer um deles invalida as descrições armazenadas.
+VISION_MODEL = "gpt-4o"
+VISION_MAX_TOKENS = 2048
+VISION_PROMPT = (
+    "Descreva detalhadamente o conteúdo visual desta imagem, "
+    "incluindo todos os gráficos, tabelas, diagramas e texto presente. "
+    "Traduza o texto para português se necessário e resuma as informações-chave. "
+    "A descrição deve ser o mais completa e objetiva possível para ser usada em um sistema de busca."
+)
+VISION_CACHE_VERSION = hashlib.sha256(
+    f"{VISION_MODEL}|{VISION_MAX_TOKENS}|{VISION_PROMPT}".encode("utf-8")
+).hexdigest()[:16]
+
+# Codificação das imagens enviadas ao modelo de visão
+DEFAULT_IMAGE_OPTIONS = {
+    "format": "JPEG",        # JPEG, WEBP ou PNG
+    "quality": 80,           # qualidade inicial para JPEG/WEBP
+    "grayscale": False,      # converte para tons de cinza antes de codificar
+    "detail": "high",        # nível de detalhe solicitado à API (low/high)
+    "max_bytes": 400_000,    # orçamento de bytes por imagem (antes do base64)
+    "max_size": 1024,        # maior lado da imagem renderizada, em pixels
+    "max_dpi": 200,          # resolução máxima (regiões pequenas não são ampliadas além disso)
+}
+IMAGE_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+IMAGE_MIN_QUALITY = 40
+
+def compute_page_hash(image: Image.Image, detail: str = "high") -> str:
+    """
+    Chave de cache derivada dos pixels da imagem enviada ao modelo, do nível de
+    detalhe e da versão do prompt/modelo. Independe do nome do arquivo e da
+    posição da página.
+    """
+    sha = hashlib.sha256()
+    sha.update(VISION_CACHE_VERSION.encode("utf-8"))
+    sha.update(detail.encode("utf-8"))
+    sha.update(f"{image.mode}-{image.width}x{image.height}".encode("utf-8"))
+    sha.update(image.tobytes())
+    return sha.hexdigest()
+
+def encode_image_to_base64(image: Image.Image, image_format: str = "JPEG", quality: int = 80,
+                           max_bytes: Optional[int] = None) -> str:
+    """
+    Converte um objeto de imagem PIL para uma string Base64 no formato pedido.
+    Se max_bytes for informado, reduz a qualidade (JPEG/WEBP) e depois a
+    resolução até que a imagem codificada caiba no orçamento.
+    """
+    image_format = image_format.upper()
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    while True:
+        buffered = io.BytesIO()
+        if image_format == "PNG":
+            image.save(buffered, format="PNG", optimize=True)
+        else:
+            image.save(buffered, format=image_format, quality=quality)
+        data = buffered.getvalue()
+
+        if max_bytes is None or len(data) <= max_bytes or min(image.size) <= 256:
+            return base64.b64encode(data).decode('utf-8')
+
+        if image_format != "PNG" and quality > IMAGE_MIN_QUALITY:
+            quality = max(IMAGE_MIN_QUALITY, quality - 10)
+        else:
+            image = image.resize((int(image.width * 0.8), int(image.height * 0.8)), Image.Resampling.LANCZOS)
+
+# Classificação local de páginas: o modelo de visão só é chamado quando a
+# página tem conteúdo visual relevante.
+VISUAL_TEXT_COVERAGE_THRESHOLD = 0.5   # páginas com mais texto que isso e só desenhos simples são textuais
+VISUAL_MIN_IMAGE_AREA_RATIO = 0.02     # imagens menores que 2% da página (logos, ícones) são ignoradas
+VISUAL_MIN_DRAWINGS = 10               # poucos desenhos vetoriais costumam ser apenas linhas de cabeçalho/rodapé
+
+def classify_page_visual_content(page, text_coverage_threshold: Optional[float] = VISUAL_TEXT_COVERAGE_THRESHOLD) -> Dict[str, Any]:
+    """
+    Decide, apenas com dados do PyMuPDF, se a página precisa de descrição visual.
+
+    A página é considerada visual quando possui imagens relevantes ou quando tem
+    desenhos vetoriais (gráficos, tabelas) e a fração da área coberta por texto
+    fica abaixo de text_coverage_threshold. Com text_coverage_threshold=None
+    todas as páginas são descritas.
+    """
+    page_area = page.rect.width * page.rect.height or 1.0
+
+    image_area = 0.0
+    image_count = 0
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        area = max(0.0, x1 - x0) * max(0.0, y1 - y0)
+        if area / page_area >= VISUAL_MIN_IMAGE_AREA_RATIO:
+            image_area += area
+            image_count += 1
+
+    drawing_count = len(page.get_drawings())
+
+    text_area = 0.0
+    for x0, y0, x1, y1, _text, _block_no, block_type in page.get_text("blocks"):
+        if block_type == 0:
+            text_area += max(0.0, x1 - x0) * max(0.0, y1 - y0)
+    text_coverage = min(text_area / page_area, 1.0)
+
+    if text_coverage_threshold is None:
+        needs_visual = True
+    else:
+        needs_visual = image_count > 0 or (
+            drawing_count >= VISUAL_MIN_DRAWINGS and text_coverage < text_coverage_threshold
+        )
+
+    return {
+        "needs_visual_description": needs_visual,
+        "image_count": image_count,
+        "drawing_count": drawing_count,
+        "text_coverage": round(text_coverage, 3),
+    }
+
+# Modo de figuras: recorta e descreve apenas as regiões de imagens/desenhos
+FIGURE_PADDING = 6                     # margem (em pontos) ao redor de cada região recortada
+FIGURE_MERGE_TOLERANCE = 12            # regiões mais próximas que isso são unidas em uma figura
+FIGURE_MAX_PER_PAGE = 6                # acima disso a página inteira é enviada
+
+def _merge_rects(rects: List["fitz.Rect"], tolerance: float) -> List["fitz.Rect"]:
+    """Une retângulos que se sobrepõem (ou estão a menos de tolerance pontos) até estabilizar."""
+    merged = [fitz.Rect(r) for r in rects]
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        while merged:
+            current = merged.pop()
+            grown = current + (-tolerance, -tolerance, tolerance, tolerance)
+            i = 0
+            while i < len(merged):
+                if grown.intersects(merged[i]):
+                    current |= merged.pop(i)
+                    grown = current + (-tolerance, -tolerance, tolerance, tolerance)
+                    changed = True
+                else:
+                    i += 1
+            result.append(current)
+        merged = result
+    return merged
+
+def locate_figure_regions(page) -> List["fitz.Rect"]:
+    """
+    Localiza as regiões de figuras da página (imagens e agrupamentos de
+    desenhos vetoriais), descartando regiões pequenas como logos e fios.
+    """
+    page_rect = page.rect
+    page_area = page_rect.width * page_rect.height or 1.0
+
+    rects = [fitz.Rect(info["bbox"]) for info in page.get_image_info()]
+    try:
+        rects.extend(page.cluster_drawings(x_tolerance=FIGURE_MERGE_TOLERANCE, y_tolerance=FIGURE_MERGE_TOLERANCE))
+    except AttributeError:
+        # Versões antigas do PyMuPDF não possuem cluster_drawings
+        rects.extend(d["rect"] for d in page.get_drawings())
+
+    regions = []
+    for rect in _merge_rects(rects, FIGURE_MERGE_TOLERANCE):
+        rect = (rect + (-FIGURE_PADDING, -FIGURE_PADDING, FIGURE_PADDING, FIGURE_PADDING)) & page_rect
+        if rect.is_empty or rect.width * rect.height / page_area < VISUAL_MIN_IMAGE_AREA_RATIO:
+            continue
+        regions.append(rect)
+
+    # Ordem de leitura: de cima para baixo, da esquerda para a direita
+    regions.sort(key=lambda r: (round(r.y0), r.x0))
+    return regions
+
+def render_page_image(page, image_options: Dict[str, Any], clip: Optional["fitz.Rect"] = None) -> Image.Image:
+    """
+    Renderiza a página (ou a região clip) diretamente no tamanho final: o zoom é
+    calculado a partir do retângulo para que o maior lado tenha max_size pixels,
+    limitado a max_dpi. Em tons de cinza o pixmap já sai com um único canal.
+    """
+    rect = page.rect if clip is None else fitz.Rect(clip) & page.rect
+    longest_side = max(rect.width, rect.height) or 1
+    zoom = min(image_options.get("max_dpi", 200) / 72, image_options.get("max_size", 1024) / longest_side)
+    colorspace = fitz.csGRAY if image_options["grayscale"] else fitz.csRGB
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, colorspace=colorspace, alpha=False)
+    return Image.frombytes("L" if pix.n == 1 else "RGB", [pix.width, pix.height], pix.samples)
+
+def _render_region(page, image_options: Dict[str, Any], clip: Optional["fitz.Rect"] = None) -> Dict[str, Any]:
+    """Renderiza a página (ou apenas a região clip) e gera o hash e o base64 da imagem."""
+    img = render_page_image(page, image_options, clip=clip)
+    logger.info(f"     Imagem renderizada: {img.width}x{img.height}")
+
+    # Gerar hash a partir do conteúdo renderizado e converter para base64
+    image_format = image_options["format"].upper()
+    img_base64 = encode_image_to_base64(
+        img,
+        image_format=image_format,
+        quality=image_options["quality"],
+        max_bytes=image_options["max_bytes"]
+    )
+    logger.info(f"     Imagem codificada em {image_format}: {len(img_base64) * 3 // 4 / 1024:.1f} KB")
+    return {
+        "bbox": [round(v, 1) for v in clip] if clip is not None else None,
+        "page_hash": compute_page_hash(img, image_options["detail"]),
+        "img_base64": img_base64,
+        "mime_type": IMAGE_MIME_TYPES[image_format],
+        "detail": image_options["detail"],
+    }
+
+def _table_to_markdown(table) -> str:
+    """Converte uma tabela do PyMuPDF em markdown (com fallback para versões sem to_markdown)."""
+    if hasattr(table, "to_markdown"):
+        return table.to_markdown(clean=False)
+    rows = [["" if cell is None else str(cell).replace("\n", " ") for cell in row] for row in table.extract()]
+    if not rows:
+        return ""
+    lines = ["| " + " | ".join(rows[0]) + " |", "|" + "---|" * len(rows[0])]
+    lines.extend("| " + " | ".join(row) + " |" for row in rows[1:])
+    return "\n".join(lines) + "\n"
+
+def extract_page_tables(page) -> List[Dict[str, Any]]:
+    """
+    Localiza as tabelas da página (page.find_tables) e as retorna em markdown
+    com a região correspondente. Retorna lista vazia em versões do PyMuPDF sem
+    detecção de tabelas ou em caso de erro.
+    """
+    if not hasattr(page, "find_tables"):
+        return []
+    try:
+        tables = []
+        for table in page.find_tables().tables:
+            markdown = _table_to_markdown(table).strip()
+            if markdown:
+                tables.append({"bbox": [round(v, 1) for v in table.bbox], "markdown": markdown})
+        return tables
+    except Exception as e:
+        logger.warning(f"     ⚠️ Falha ao detectar tabelas: {e}")
+        return []
+
+def _extract_text_outside(page, regions: List[List[float]]) -> str:
+    """Texto da página sem os blocos contidos nas regiões informadas (ex.: tabelas já extraídas)."""
+    rects = [fitz.Rect(region) for region in regions]
+    blocks = page.get_text("blocks", sort=True)
+    return "".join(
+        block[4] if block[4].endswith("\n") else block[4] + "\n"
+        for block in blocks
+        if block[6] == 0 and not any(rect.contains(fitz.Rect(block[:4])) for rect in rects)
+    )
+
+def _extract_page_payload(page, page_num: int, page_options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extrai o texto, as tabelas e a classificação visual de uma página já aberta
+    e, se a página precisar de descrição visual, as imagens a descrever: a página
+    inteira ou, no modo de figuras, cada região de figura recortada. O texto das
+    tabelas detectadas é removido do texto corrido para não ser indexado duas vezes.
+    """
+    tables = extract_page_tables(page) if page_options.get("table_mode", True) else []
+    if tables:
+        text_content = _extract_text_outside(page, [table["bbox"] for table in tables])
+        logger.info(f"     {len(tables)} tabela(s) detectada(s)")
+    else:
+        text_content = page.get_text()
+    logger.info(f"     Texto extraído: {len(text_content)} caracteres")
+
+    payload = {
+        "page_num": page_num,
+        "text_content": text_content,
+        "tables": tables,
+        "images": [],
+        "visual": classify_page_visual_content(page, page_options.get("text_coverage_threshold")),
+    }
+
+    if not payload["visual"]["needs_visual_description"]:
+        logger.info(f"     Página textual (cobertura de texto {payload['visual']['text_coverage']:.0%}), "
+                    f"descrição visual dispensada")
+        return payload
+
+    if page_options.get("figure_mode"):
+        regions = locate_figure_regions(page)
+        if 0 < len(regions) <= FIGURE_MAX_PER_PAGE:
+            logger.info(f"     Recortando {len(regions)} figura(s) da página...")
+            payload["images"] = [_render_region(page, page_options["image_options"], clip=rect) for rect in regions]
+            return payload
+        logger.info(f"     {len(regions)} regiões de figura encontradas, usando a página inteira")
+
+    # Extrair imagem da página
+    logger.info(f"     Convertendo página para imagem...")
+    payload["images"] = [_render_region(page, page_options["image_options"])]
+    return payload
+
+# Documentos abertos em cada processo do pool de renderização. As páginas de um
+# PDF são enviadas em sequência, então cada processo abre cada arquivo uma única vez.
+_WORKER_DOCUMENTS_MAX = 2
+_worker_documents: "OrderedDict[str, Any]" = OrderedDict()
+
+def _get_worker_document(pdf_path: str):
+    """Retorna o documento aberto neste processo, abrindo-o (e fechando o mais antigo) se preciso."""
+    doc = _worker_documents.get(pdf_path)
+    if doc is not None:
+        _worker_documents.move_to_end(pdf_path)
+        return doc
+    doc = fitz.open(pdf_path)
+    _worker_documents[pdf_path] = doc
+    while len(_worker_documents) > _WORKER_DOCUMENTS_MAX:
+        _path, old_doc = _worker_documents.popitem(last=False)
+        old_doc.close()
+    return doc
+
+def _render_page_payload(pdf_path: str, page_index: int, page_options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extrai o payload de uma única página usando o documento em cache no processo.
+    Executada nos processos do pool de renderização, por isso recebe apenas tipos serializáveis.
+    """
+    doc = _get_worker_document(pdf_path)
+    return _extract_page_payload(doc[page_index], page_index + 1, page_options)
+
+
+def init_render_worker():
+    """Initializer do pool de renderização: configura o logging do processo filho."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
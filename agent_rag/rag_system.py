@@ -5,17 +5,27 @@ import os
 from typing import List, Dict, Any, Optional, Tuple
 import logging
 import csv
+import time
+from collections import OrderedDict
 from datetime import datetime
 import numpy as np
 from chromadb.utils import embedding_functions # Linha de importação adicionada!
+from collection_alias import resolve_collection_name, aliases_signature, get_alias_entry
+from utils import rate_limited_http_client
+from embedding_cache import EmbeddingCache, QueryEmbeddingCache, normalize_query, content_hash
+from answer_cache import SemanticAnswerCache, ANSWER_CACHE_THRESHOLD
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from concurrent.futures import ThreadPoolExecutor
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Importação condicional do reranker
+# Importação condicional do reranker (sentence-transformers traz o PyTorch usado
+# no fallback e na exportação para ONNX)
 try:
-    from sentence_transformers import CrossEncoder
+    import sentence_transformers  # noqa: F401
+    from onnx_reranker import load_reranker
     RERANKER_AVAILABLE = True
 except ImportError:
     RERANKER_AVAILABLE = False
@@ -30,9 +40,43 @@ class RagSystem:
                  reranker_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
                  enable_reranking: bool = True,
                  enable_logging: bool = True,
+                 max_context_tokens: int = 6000,
+                 query_cache_size: int = 256,
+                 query_cache_ttl: Optional[float] = 3600,
+                 query_cache_path: Optional[str] = "cache/query_embeddings.sqlite",
+                 answer_cache_threshold: Optional[float] = ANSWER_CACHE_THRESHOLD,
+                 answer_cache_size: int = 500,
+                 answer_cache_ttl: Optional[float] = 24 * 3600,
+                 hybrid_search: bool = True,
+                 rrf_k: int = 60,
+                 rerank_batch_size: int = 16,
+                 rerank_time_budget: Optional[float] = 3.0,
+                 rerank_cache_size: int = 4096,
+                 reranker_backend: str = "auto",
+                 reranker_threads: Optional[int] = None,
                  **kwargs):
         """
         Inicializa o sistema RAG aprimorado.
+        
+        Os embeddings das consultas ficam em um cache LRU (query_cache_size
+        entradas, expiração de query_cache_ttl segundos) com uma camada em disco
+        em query_cache_path (None desativa o disco).
+        
+        Respostas são reaproveitadas para consultas semelhantes (cosseno >=
+        answer_cache_threshold; None desativa) enquanto a versão da coleção
+        não mudar; veja SemanticAnswerCache.
+        
+        Com hybrid_search, a busca vetorial é combinada (fusão por posição
+        recíproca, constante rrf_k) com o índice BM25 gerado na ingestão.
+        
+        O reranking avalia os pares em lotes de rerank_batch_size ordenados por
+        tamanho, guarda as pontuações por (consulta, chunk) em um cache LRU de
+        rerank_cache_size entradas e, se passar de rerank_time_budget segundos,
+        mantém a ordem da recuperação.
+        
+        reranker_backend escolhe a execução do cross-encoder ("auto", "onnx",
+        "onnx-fp32" ou "torch"; veja onnx_reranker.load_reranker) e
+        reranker_threads limita as threads de inferência.
         """
         load_dotenv()
         
@@ -43,31 +87,61 @@ class RagSystem:
         self.collection_name = collection_name
         self.enable_reranking = enable_reranking and RERANKER_AVAILABLE
         self.enable_logging = enable_logging
+        self.hybrid_search = hybrid_search
+        self.rrf_k = rrf_k
+        self.bm25_index = None
+        self._search_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-search")
+        self.max_context_tokens = max_context_tokens
         self.log_file = f"rag_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         
         self.chroma_client = chromadb.PersistentClient(path=self.chroma_path)
         
         # Agora a linha abaixo funcionará porque embedding_functions foi importado
+        self.embedding_model = "text-embedding-3-small"
         self.embedding_function = embedding_functions.OpenAIEmbeddingFunction(
             api_key=os.environ.get("OPENAI_API_KEY"),
-            model_name="text-embedding-3-small"
-        )
-        self.collection = self.chroma_client.get_or_create_collection(
-            name=self.collection_name, 
-            embedding_function=self.embedding_function
+            model_name=self.embedding_model,
+            api_base=os.environ.get("OPENAI_BASE_URL")
         )
+        # collection_name é um alias: a versão ativa é resolvida (e reavaliada) a cada consulta
+        self.active_collection_name = None
+        self.collection_version = None
+        self._aliases_signature = None
+        self.collection = None
+        self._refresh_collection()
+        
+        self.rerank_batch_size = rerank_batch_size
+        self.rerank_time_budget = rerank_time_budget
+        self.rerank_cache_size = rerank_cache_size
+        self._rerank_cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self.rerank_stats = {"pairs": 0, "cache_hits": 0, "budget_fallbacks": 0}
         
         self.reranker = None
         if self.enable_reranking:
             logger.info("Carregando modelo reranker...")
             try:
-                self.reranker = CrossEncoder(reranker_model)
-                logger.info("✅ Modelo reranker carregado.")
+                self.reranker = load_reranker(reranker_model, backend=reranker_backend,
+                                              intra_op_threads=reranker_threads)
+                logger.info(f"✅ Modelo reranker carregado ({self.reranker.backend}).")
             except Exception as e:
                 logger.error(f"Erro ao carregar reranker. Desabilitando. Erro: {e}")
                 self.enable_reranking = False
 
-        self.openai_client = OpenAI()
+        # Embeddings de consulta e respostas passam pelo limitador de taxa compartilhado
+        self.openai_client = OpenAI(http_client=rate_limited_http_client())
+        self.query_embedding_cache = QueryEmbeddingCache(
+            model=self.embedding_model,
+            max_entries=query_cache_size,
+            ttl_seconds=query_cache_ttl,
+            disk_cache=EmbeddingCache(query_cache_path) if query_cache_path else None
+        )
+        self.answer_cache = None
+        if answer_cache_threshold is not None:
+            self.answer_cache = SemanticAnswerCache(
+                threshold=answer_cache_threshold,
+                max_entries=answer_cache_size,
+                ttl_seconds=answer_cache_ttl
+            )
         
         # Prompt do sistema atualizado para conteúdo multimodal
         self.system_prompt_template = """
@@ -98,73 +172,225 @@ class RagSystem:
         💡 Confiança dos documentos: {confidence_scores}
         """
 
-    def _query_vector_db(self, query: str, top_k: int = 10) -> List[Dict[str, Any]]:
+    def _refresh_collection(self):
         """
-        Consulta o banco de dados vetorial.
+        Reaponta self.collection quando o alias da coleção foi trocado por uma
+        nova ingestão, sem expor coleções de staging parcialmente populadas.
+        """
+        signature = aliases_signature(self.chroma_path)
+        if self.collection is not None and signature == self._aliases_signature:
+            return
+        
+        active_name = resolve_collection_name(self.chroma_path, self.collection_name)
+        if active_name != self.active_collection_name:
+            self.collection = self.chroma_client.get_or_create_collection(
+                name=active_name, 
+                embedding_function=self.embedding_function
+            )
+            if self.active_collection_name is not None:
+                logger.info(f"🔀 Coleção ativa alterada: '{self.active_collection_name}' -> '{active_name}'")
+            self.active_collection_name = active_name
+        # A versão muda tanto na troca do alias quanto em atualizações incrementais no lugar
+        updated_at = get_alias_entry(self.chroma_path, self.collection_name).get("updated_at", "")
+        version = f"{active_name}@{updated_at}"
+        if self.hybrid_search and version != self.collection_version:
+            # O índice é reconstruído a cada ingestão, inclusive nas incrementais
+            self.bm25_index = BM25Index.load(self.chroma_path, active_name)
+            if self.bm25_index is None:
+                logger.warning(f"Índice BM25 de '{active_name}' não encontrado; usando apenas a busca vetorial.")
+        self.collection_version = version
+        self._aliases_signature = signature
+
+    def _embed_query(self, query: str) -> List[float]:
+        """
+        Gera o embedding da consulta com o cliente OpenAI do sistema (sujeito ao
+        limitador de taxa), no lugar da função de embedding interna do Chroma.
+        Consultas repetidas (a menos de espaços) são atendidas pelo cache.
+        """
+        def compute(normalized_query: str) -> List[float]:
+            response = self.openai_client.embeddings.create(
+                model=self.embedding_model,
+                input=[normalized_query]
+            )
+            return response.data[0].embedding
+        
+        return self.query_embedding_cache.get_or_compute(query, compute)
+
+    def _query_vector_db(self, query: str, top_k: int = 10,
+                         chunk_types: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Consulta o banco de dados vetorial. chunk_types restringe a busca a
+        tipos de chunk ("text", "table", "visual"). Com o índice BM25
+        disponível, a busca lexical roda em paralelo e os resultados são
+        combinados por RRF (veja _fuse_lexical_results).
         """
         try:
+            self._refresh_collection()
+            lexical_future = None
+            if self.bm25_index is not None:
+                lexical_future = self._search_pool.submit(self.bm25_index.search, query, top_k, chunk_types)
+            where = None
+            if chunk_types:
+                where = {"chunk_type": {"$in": list(chunk_types)}}
             results = self.collection.query(
-                query_texts=[query],
+                query_embeddings=[self._embed_query(query)],
                 n_results=top_k,
+                where=where,
                 include=['metadatas', 'documents', 'distances']
             )
             
             formatted_results = []
             for i in range(len(results['documents'][0])):
                 formatted_results.append({
+                    'id': results['ids'][0][i],
                     'document': results['documents'][0][i],
                     'metadata': results['metadatas'][0][i],
                     'distance': results['distances'][0][i]
                 })
             
+            if lexical_future is not None:
+                try:
+                    formatted_results = self._fuse_lexical_results(formatted_results, lexical_future.result(), top_k)
+                except Exception as e:
+                    logger.error(f"Erro na busca BM25, usando apenas a busca vetorial: {e}")
+            
             return formatted_results
         except Exception as e:
             logger.error(f"Erro ao consultar o banco de dados vetorial: {e}")
             return []
 
+    def _fuse_lexical_results(self, vector_results: List[Dict[str, Any]], lexical_hits: List[Tuple[str, float]],
+                              top_k: int) -> List[Dict[str, Any]]:
+        """
+        Combina os resultados vetoriais e BM25 por fusão de posição recíproca.
+        Chunks encontrados apenas pelo BM25 são buscados na coleção (sem
+        'distance'); cada documento recebe 'rrf_score' e, se houver, 'bm25_score'.
+        """
+        documents_by_id = {doc['id']: doc for doc in vector_results}
+        lexical_scores = dict(lexical_hits)
+        fused = reciprocal_rank_fusion(
+            [[doc['id'] for doc in vector_results], [doc_id for doc_id, _score in lexical_hits]],
+            k=self.rrf_k
+        )[:top_k]
+        
+        missing = [doc_id for doc_id, _score in fused if doc_id not in documents_by_id]
+        if missing:
+            extra = self.collection.get(ids=missing, include=['documents', 'metadatas'])
+            for doc_id, document, metadata in zip(extra['ids'], extra['documents'], extra['metadatas']):
+                documents_by_id[doc_id] = {'id': doc_id, 'document': document, 'metadata': metadata}
+        
+        merged = []
+        for doc_id, score in fused:
+            doc = documents_by_id.get(doc_id)
+            if doc is None:
+                continue  # removido da coleção depois da construção do índice
+            doc['rrf_score'] = score
+            if doc_id in lexical_scores:
+                doc['bm25_score'] = lexical_scores[doc_id]
+            merged.append(doc)
+        
+        logger.info(f"Busca híbrida: {len(vector_results)} vetoriais, {len(lexical_hits)} BM25, "
+                    f"{len(missing)} apenas lexicais, {len(merged)} após a fusão")
+        return merged
+
     def _rerank_documents(self, query: str, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         Reranqueia os documentos usando um modelo Cross-Encoder.
+        
+        Pares já avaliados para a mesma consulta vêm do cache; os demais são
+        ordenados por tamanho (menos padding por lote) e avaliados em lotes de
+        rerank_batch_size. Se o orçamento de tempo acabar antes do último lote,
+        os documentos ficam na ordem da recuperação (as pontuações já calculadas
+        são guardadas no cache para a próxima vez).
         """
         if not self.enable_reranking or not documents:
             return documents
         
-        pairs = [[query, doc['document']] for doc in documents]
-        scores = self.reranker.predict(pairs)
+        query_key = content_hash(normalize_query(query))
+        # O id do chunk é derivado da posição (arquivo/página/índice); o hash do conteúdo
+        # evita reaproveitar a pontuação de um chunk que mudou em uma nova ingestão
+        keys = [(query_key, f"{doc.get('id', '')}:{content_hash(doc['document'])[:16]}") for doc in documents]
+        scores = {}
+        for key in keys:
+            if key in self._rerank_cache:
+                self._rerank_cache.move_to_end(key)
+                scores[key] = self._rerank_cache[key]
+        self.rerank_stats["cache_hits"] += len(scores)
+        
+        pending = sorted(
+            {key: doc for key, doc in zip(keys, documents) if key not in scores}.items(),
+            key=lambda item: len(item[1]['document'])
+        )
+        start = time.monotonic()
+        for i in range(0, len(pending), self.rerank_batch_size):
+            if self.rerank_time_budget is not None and time.monotonic() - start > self.rerank_time_budget:
+                self.rerank_stats["budget_fallbacks"] += 1
+                logger.warning(f"Reranking excedeu {self.rerank_time_budget:.1f}s; mantendo a ordem da recuperação.")
+                return documents
+            batch = pending[i:i + self.rerank_batch_size]
+            batch_scores = self.reranker.predict(
+                [[query, doc['document']] for _key, doc in batch],
+                batch_size=self.rerank_batch_size,
+                show_progress_bar=False
+            )
+            self.rerank_stats["pairs"] += len(batch)
+            for (key, _doc), score in zip(batch, batch_scores):
+                scores[key] = float(score)
+                self._rerank_cache[key] = float(score)
+            while len(self._rerank_cache) > self.rerank_cache_size:
+                self._rerank_cache.popitem(last=False)
         
-        for i, doc in enumerate(documents):
-            doc['rerank_score'] = scores[i]
+        for key, doc in zip(keys, documents):
+            doc['rerank_score'] = scores[key]
             
         documents.sort(key=lambda x: x['rerank_score'], reverse=True)
         
         return documents
 
-    def _format_docs(self, documents: List[Dict[str, Any]], top_k_reranked: int = 5) -> Tuple[str, str]:
+    def _format_docs(self, documents: List[Dict[str, Any]], top_k_reranked: int = 5,
+                     max_context_tokens: Optional[int] = None) -> Tuple[str, str]:
         """
         Formata os documentos para o prompt e calcula a confiança.
+        
+        Os documentos entram na ordem de relevância até top_k_reranked ou até
+        esgotar max_context_tokens; um documento que não cabe no que resta do
+        orçamento é pulado. O tamanho vem do token_count gravado na ingestão
+        (chunks antigos, sem esse campo, são estimados em ~4 caracteres por token).
         """
         docs_str = []
         confidence_scores = []
+        budget = self.max_context_tokens if max_context_tokens is None else max_context_tokens
+        used_tokens = 0
         
-        num_docs_to_use = min(top_k_reranked, len(documents))
-        
-        for doc in documents[:num_docs_to_use]:
+        for doc in documents:
+            if len(docs_str) >= top_k_reranked:
+                break
+            
             metadata = doc.get('metadata', {})
             source = metadata.get('source', 'Desconhecida').split('/')[-1]
             page = metadata.get('page', 'Desconhecida')
             
             doc_info = f"--- Fonte: {source} (Página {page}) ---\n"
+            doc_tokens = metadata.get('token_count') or len(doc.get('document', '')) // 4
+            doc_tokens += len(doc_info) // 4
+            if budget and used_tokens + doc_tokens > budget:
+                continue
+            
             doc_info += doc.get('document', '')
             docs_str.append(doc_info)
+            used_tokens += doc_tokens
             
             score = doc.get('rerank_score', 1 - doc.get('distance', 1))
             confidence_scores.append(f"{score:.4f}")
-            
+        
+        logger.info(f"Contexto: {len(docs_str)} documentos, ~{used_tokens} tokens")
         return "\n\n".join(docs_str), ", ".join(confidence_scores)
 
-    def _generate_response_with_openai(self, query: str, formatted_docs: str, confidence_scores: str) -> str:
+    def _generate_response_with_openai(self, query: str, formatted_docs: str, confidence_scores: str,
+                                       usage: Optional[Dict[str, int]] = None) -> str:
         """
         Gera a resposta final usando a API da OpenAI.
+        Se usage for informado, recebe o consumo de tokens da chamada.
         """
         try:
             system_prompt = self.system_prompt_template.format(
@@ -184,6 +410,8 @@ class RagSystem:
                 max_tokens=2048
             )
             
+            if usage is not None and response.usage:
+                usage["total_tokens"] = response.usage.total_tokens
             return response.choices[0].message.content
         except Exception as e:
             logger.error(f"Erro ao gerar resposta com a OpenAI: {e}")
@@ -218,13 +446,33 @@ class RagSystem:
                 result.get('confidence_scores', 'N/A')
             ])
 
-    def query_rag_system(self, query: str, top_k_retrieval: int = 10, top_k_reranked: int = 5) -> Dict[str, Any]:
+    def query_rag_system(self, query: str, top_k_retrieval: int = 10, top_k_reranked: int = 5,
+                         chunk_types: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Executa a pipeline completa de RAG e retorna o resultado.
+        chunk_types limita a recuperação a tipos de chunk (ex.: ["table"]).
         """
         logger.info(f"Pergunta do usuário: '{query}'")
         
-        retrieved_docs = self._query_vector_db(query, top_k=top_k_retrieval)
+        cache_params = (top_k_retrieval, top_k_reranked, tuple(chunk_types or ()))
+        query_vector = None
+        if self.answer_cache is not None:
+            try:
+                self._refresh_collection()
+                query_vector = self._embed_query(query)
+                cached = self.answer_cache.lookup(query, query_vector, self.collection_version, cache_params)
+            except Exception as e:
+                logger.error(f"Erro ao consultar o cache de respostas: {e}")
+                cached = None
+            if cached:
+                logger.info(f"♻️ Resposta reaproveitada do cache (similaridade {cached['similarity']:.3f} "
+                            f"com '{cached['query']}')")
+                result = {**cached["result"], "cached": True, "cached_query": cached["query"],
+                          "cache_similarity": cached["similarity"]}
+                self.log_query(query, result)
+                return result
+        
+        retrieved_docs = self._query_vector_db(query, top_k=top_k_retrieval, chunk_types=chunk_types)
         
         if not retrieved_docs:
             logger.warning("Nenhum documento relevante encontrado.")
@@ -241,7 +489,8 @@ class RagSystem:
 
         formatted_docs, confidence_scores = self._format_docs(reranked_docs, top_k_reranked=top_k_reranked)
 
-        final_response = self._generate_response_with_openai(query, formatted_docs, confidence_scores)
+        usage = {}
+        final_response = self._generate_response_with_openai(query, formatted_docs, confidence_scores, usage=usage)
         
         result = {
             "response": final_response,
@@ -253,18 +502,30 @@ class RagSystem:
         
         self.log_query(query, result)
         
+        # Só respostas geradas com sucesso (com consumo registrado) entram no cache
+        if self.answer_cache is not None and query_vector is not None and usage:
+            self.answer_cache.store(query, query_vector, self.collection_version, cache_params,
+                                    result, usage["total_tokens"])
+        
         logger.info("✅ Resposta gerada com sucesso.")
         return result
 
     def get_system_info(self) -> Dict[str, Any]:
         """Retorna informações sobre o status do sistema RAG."""
         try:
+            self._refresh_collection()
             num_docs = self.collection.count()
             rag_available = num_docs > 0
             return {
                 "rag_available": rag_available,
                 "rag_status": f"{num_docs} documentos carregados." if rag_available else "Base de dados vazia.",
+                "active_collection": self.active_collection_name,
+                "hybrid_search": self.bm25_index is not None,
+                "query_embedding_cache": self.query_embedding_cache.info(),
+                "answer_cache": self.answer_cache.info() if self.answer_cache else None,
                 "reranking_enabled": self.enable_reranking,
+                "reranker_backend": self.reranker.backend if self.reranker else None,
+                "rerank_stats": dict(self.rerank_stats),
                 "llm_model": "gpt-4o"
             }
         except Exception as e:
@@ -273,4 +534,4 @@ class RagSystem:
                 "rag_status": f"Erro ao acessar ChromaDB: {e}",
                 "reranking_enabled": self.enable_reranking,
                 "llm_model": "gpt-4o"
-            }
\ No newline at end of file
+            }
\ No newline at end of file
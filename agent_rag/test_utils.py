@@ -0,0 +1,76 @@
+# test_utils.py - Testes do decorador de novas tentativas
+import asyncio
+
+import httpx
+import pytest
+from openai import RateLimitError
+
+import utils
+from utils import retry_with_exponential_backoff
+
+
+def _rate_limit_error() -> RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return RateLimitError("Rate limit reached", response=httpx.Response(429, request=request), body=None)
+
+
+def test_retries_rate_limit_errors_until_success(monkeypatch):
+    delays = []
+    monkeypatch.setattr(utils.time, "sleep", delays.append)
+    calls = []
+
+    @retry_with_exponential_backoff(initial_delay=1, max_retries=3, max_delay=5)
+    def flaky():
+        calls.append(1)
+        if len(calls) <= 2:
+            raise _rate_limit_error()
+        return "ok"
+
+    assert flaky() == "ok"
+    assert len(calls) == 3
+    assert len(delays) == 2
+    assert all(0 <= delay <= 5 for delay in delays)
+
+
+def test_async_retries_rate_limit_errors_until_success(monkeypatch):
+    async def no_sleep(_delay):
+        return None
+
+    monkeypatch.setattr(utils.asyncio, "sleep", no_sleep)
+    calls = []
+
+    @retry_with_exponential_backoff(initial_delay=1, max_retries=3)
+    async def flaky():
+        calls.append(1)
+        if len(calls) <= 2:
+            raise _rate_limit_error()
+        return "ok"
+
+    assert asyncio.run(flaky()) == "ok"
+    assert len(calls) == 3
+
+
+def test_does_not_retry_unrelated_errors(monkeypatch):
+    monkeypatch.setattr(utils.time, "sleep", lambda _delay: None)
+    calls = []
+
+    @retry_with_exponential_backoff(max_retries=3)
+    def broken():
+        calls.append(1)
+        raise KeyError("chave")
+
+    with pytest.raises(KeyError):
+        broken()
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(utils.time, "sleep", lambda _delay: None)
+
+    @retry_with_exponential_backoff(max_retries=2)
+    def always_limited():
+        raise _rate_limit_error()
+
+    with pytest.raises(RuntimeError) as excinfo:
+        always_limited()
+    assert isinstance(excinfo.value.__cause__, RateLimitError)
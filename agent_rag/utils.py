@@ -1,7 +1,16 @@
 # utils.py
+import os
+import re
+import json
 import random
 import time
-from openai import RateLimitError, APIError, Timeout
+import asyncio
+import functools
+import threading
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+import httpx
+from openai import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
 
 def retry_with_exponential_backoff(
     func=None,
@@ -9,34 +18,342 @@ def retry_with_exponential_backoff(
     exponential_base: float = 2,
     jitter: bool = True,
     max_retries: int = 5,
-    errors: tuple = (RateLimitError, APIError, Timeout)
+    errors: tuple = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError),
+    max_delay: float = 60,
+    deadline: Optional[float] = None,
+    on_attempt: Optional[Callable[[Dict[str, Any]], None]] = None
 ):
-    """Retry a function with exponential backoff."""
+    """
+    Retry a function with exponential backoff.
+
+    Works on both regular functions and coroutines (coroutines wait with
+    asyncio.sleep, so the event loop is never blocked). The delay before retry
+    n is capped at max_delay and, with jitter, drawn uniformly from
+    [0, min(max_delay, initial_delay * exponential_base ** (n - 1))]
+    ("full jitter"). deadline limits the total time in seconds, including
+    the waits. on_attempt receives a dict per attempt with attempt, elapsed,
+    success, error and delay (the wait before the next attempt, or None).
+    By default only transient OpenAI errors are retried (429, timeouts,
+    connection errors and 5xx); other errors propagate immediately.
+    """
+    def next_delay(num_retries: int) -> float:
+        capped = min(max_delay, initial_delay * exponential_base ** (num_retries - 1))
+        return random.uniform(0, capped) if jitter else capped
+
+    def report(attempt: int, start: float, error: Optional[BaseException], delay: Optional[float]):
+        if on_attempt:
+            on_attempt({
+                "attempt": attempt,
+                "elapsed": time.monotonic() - start,
+                "success": error is None,
+                "error": error,
+                "delay": delay
+            })
+
+    def handle_error(e: BaseException, num_retries: int, start: float) -> float:
+        """Decide se haverá nova tentativa e retorna a espera; relança caso contrário."""
+        if num_retries > max_retries:
+            report(num_retries, start, e, None)
+            raise RuntimeError(f"Máximo de {max_retries} tentativas excedido.") from e
+
+        delay = next_delay(num_retries)
+        if deadline is not None and time.monotonic() - start + delay > deadline:
+            report(num_retries, start, e, None)
+            raise RuntimeError(f"Prazo de {deadline:.0f}s excedido após {num_retries} tentativa(s).") from e
+
+        report(num_retries, start, e, delay)
+        print(f"Erro na API da OpenAI. Tentativa {num_retries}/{max_retries}. Retentando em {delay:.2f} segundos...")
+        return delay
+
     def decorator(func):
 
-        def wrapper(*args, **kwargs):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                num_retries = 0
+                start = time.monotonic()
 
+                while True:
+                    try:
+                        result = await func(*args, **kwargs)
+                        report(num_retries + 1, start, None, None)
+                        return result
+                    except errors as e:
+                        num_retries += 1
+                        await asyncio.sleep(handle_error(e, num_retries, start))
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
             num_retries = 0
-            delay = initial_delay
+            start = time.monotonic()
 
             while True:
                 try:
-                    return func(*args, **kwargs)
-                
+                    result = func(*args, **kwargs)
+                    report(num_retries + 1, start, None, None)
+                    return result
                 except errors as e:
                     num_retries += 1
-
-                    if num_retries > max_retries:
-                        raise RuntimeError(f"Máximo de {max_retries} tentativas excedido.") from e
-                    
-                    delay *= exponential_base * (1 + jitter * random.random())
-                    
-                    print(f"Erro na API da OpenAI. Tentativa {num_retries}/{max_retries}. Retentando em {delay:.2f} segundos...")
-                    time.sleep(delay)
-                
-                except Exception as e:
-                    raise e
+                    time.sleep(handle_error(e, num_retries, start))
         
         return wrapper
     
-    return decorator if func is None else decorator(func)
\ No newline at end of file
+    return decorator if func is None else decorator(func)
+
+
+# Limites iniciais por modelo (requisições e tokens por minuto). Servem só até a
+# primeira resposta: os cabeçalhos x-ratelimit-limit-* redimensionam os baldes
+# para o tier real da conta. Podem ser sobrescritos por OPENAI_RATE_LIMITS.
+DEFAULT_RATE_LIMITS = {
+    "gpt-4o": {"rpm": 500, "tpm": 30_000},
+    "text-embedding-3-small": {"rpm": 3_000, "tpm": 1_000_000},
+}
+FALLBACK_RATE_LIMIT = {"rpm": 500, "tpm": 200_000}
+RATE_LIMITS_ENV_VAR = "OPENAI_RATE_LIMITS"
+
+# Custo aproximado, em tokens, de uma imagem enviada ao modelo de visão
+IMAGE_TOKENS = {"low": 85, "high": 765}
+
+
+def load_rate_limits(overrides: Optional[Dict[str, Dict[str, int]]] = None) -> Dict[str, Dict[str, int]]:
+    """
+    Limites por modelo: DEFAULT_RATE_LIMITS, sobrescritos pelo JSON da variável
+    OPENAI_RATE_LIMITS e depois por overrides. A chave "*" vale para modelos não
+    listados. Ex.: OPENAI_RATE_LIMITS='{"gpt-4o": {"rpm": 5000, "tpm": 800000}}'.
+    """
+    limits = {model: dict(limit) for model, limit in DEFAULT_RATE_LIMITS.items()}
+    limits["*"] = dict(FALLBACK_RATE_LIMIT)
+
+    sources = []
+    raw = os.getenv(RATE_LIMITS_ENV_VAR)
+    if raw:
+        try:
+            sources.append(json.loads(raw))
+        except ValueError as e:
+            print(f"Aviso: {RATE_LIMITS_ENV_VAR} inválido, usando os limites padrão. Erro: {e}")
+    if overrides:
+        sources.append(overrides)
+
+    for source in sources:
+        for model, limit in source.items():
+            target = limits.setdefault(model, dict(limits["*"]))
+            target.update({key: int(value) for key, value in limit.items() if key in ("rpm", "tpm")})
+    return limits
+
+
+def _parse_reset_duration(value: str) -> float:
+    """Converte durações dos cabeçalhos da OpenAI ('1s', '6m0s', '20ms') em segundos."""
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value or ""):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+
+def estimate_request_tokens(body: dict) -> int:
+    """Estimativa (~4 caracteres por token) dos tokens de uma requisição de chat ou embeddings."""
+    if "input" in body:
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        return sum(len(str(text)) for text in inputs) // 4 + 1
+
+    tokens = body.get("max_tokens") or body.get("max_completion_tokens") or 0
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // 4
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    tokens += len(part.get("text", "")) // 4
+                elif part.get("type") == "image_url":
+                    tokens += IMAGE_TOKENS.get(part.get("image_url", {}).get("detail", "high"), IMAGE_TOKENS["high"])
+    return tokens + 1
+
+
+def _header_float(headers: Mapping[str, str], name: str) -> Optional[float]:
+    try:
+        return float(headers[name]) if headers.get(name) is not None else None
+    except ValueError:
+        return None
+
+
+class _ModelBuckets:
+    """Baldes de requisições e de tokens de um modelo."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def refill(self, now: float):
+        elapsed = now - self.updated
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+        self.updated = now
+
+    def resize(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        """
+        Ajusta a capacidade para o limite informado pela API (para cima ou para
+        baixo); a diferença é somada ao saldo, preservando o consumo em andamento.
+        """
+        if rpm and rpm != self.rpm:
+            self.requests = max(0.0, min(rpm, self.requests + rpm - self.rpm))
+            self.rpm = rpm
+        if tpm and tpm != self.tpm:
+            self.tokens = max(0.0, min(tpm, self.tokens + tpm - self.tpm))
+            self.tpm = tpm
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        """Segundos até a requisição caber nos dois baldes (0 se já cabe)."""
+        tokens = min(tokens, self.tpm)
+        waits = [self.paused_until - now]
+        if self.requests < 1:
+            waits.append((1 - self.requests) * 60 / self.rpm)
+        if self.tokens < tokens:
+            waits.append((tokens - self.tokens) * 60 / self.tpm)
+        return max(0.0, *waits)
+
+
+class RateLimiter:
+    """
+    Limitador token-bucket no cliente, com limites de requisições e de tokens
+    por minuto para cada modelo. limits (ou OPENAI_RATE_LIMITS) define a
+    capacidade inicial; os cabeçalhos x-ratelimit-limit-* das respostas a
+    redimensionam, x-ratelimit-remaining-* corrige o saldo e o Retry-After de
+    respostas 429 pausa o modelo. Seguro para uso em várias threads e em código
+    assíncrono.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, int]]] = None):
+        self.limits = load_rate_limits(limits)
+        self._buckets: Dict[str, _ModelBuckets] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, model: str) -> _ModelBuckets:
+        if model not in self._buckets:
+            limit = self.limits.get(model, self.limits["*"])
+            self._buckets[model] = _ModelBuckets(limit["rpm"], limit["tpm"])
+        return self._buckets[model]
+
+    def _try_acquire(self, model: str, tokens: int) -> float:
+        """Consome a capacidade se disponível; caso contrário retorna o tempo de espera."""
+        with self._lock:
+            bucket = self._bucket(model)
+            now = time.monotonic()
+            bucket.refill(now)
+            wait = bucket.wait_time(tokens, now)
+            if wait <= 0:
+                bucket.requests -= 1
+                bucket.tokens -= min(tokens, bucket.tpm)
+            return wait
+
+    def acquire(self, model: str, tokens: int = 1):
+        """Bloqueia a thread até haver capacidade para a requisição."""
+        while True:
+            wait = self._try_acquire(model, tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, model: str, tokens: int = 1):
+        """Versão assíncrona de acquire (não bloqueia o event loop)."""
+        while True:
+            wait = self._try_acquire(model, tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def update_from_headers(self, model: str, status_code: int, headers: Mapping[str, str]):
+        """Ajusta os baldes com os cabeçalhos de limite da resposta."""
+        with self._lock:
+            bucket = self._bucket(model)
+            bucket.refill(time.monotonic())
+            bucket.resize(rpm=_header_float(headers, "x-ratelimit-limit-requests"),
+                          tpm=_header_float(headers, "x-ratelimit-limit-tokens"))
+            # O saldo do servidor ainda não desconta requisições em andamento: só reduz o local
+            remaining_requests = _header_float(headers, "x-ratelimit-remaining-requests")
+            if remaining_requests is not None:
+                bucket.requests = min(bucket.requests, remaining_requests)
+            remaining_tokens = _header_float(headers, "x-ratelimit-remaining-tokens")
+            if remaining_tokens is not None:
+                bucket.tokens = min(bucket.tokens, remaining_tokens)
+
+            if status_code == 429:
+                retry_after = headers.get("retry-after-ms")
+                if retry_after is not None:
+                    delay = float(retry_after) / 1000
+                elif headers.get("retry-after") is not None:
+                    delay = float(headers["retry-after"])
+                else:
+                    delay = max(_parse_reset_duration(headers.get("x-ratelimit-reset-requests", "")),
+                                _parse_reset_duration(headers.get("x-ratelimit-reset-tokens", "")), 1.0)
+                bucket.paused_until = max(bucket.paused_until, time.monotonic() + delay)
+                bucket.requests = min(bucket.requests, 0.0)
+
+
+_shared_rate_limiter: Optional[RateLimiter] = None
+_shared_rate_limiter_lock = threading.Lock()
+
+
+def get_openai_rate_limiter() -> RateLimiter:
+    """
+    Limitador único do processo, compartilhado por todos os clientes da OpenAI
+    (limites iniciais lidos de OPENAI_RATE_LIMITS na primeira chamada).
+    """
+    global _shared_rate_limiter
+    with _shared_rate_limiter_lock:
+        if _shared_rate_limiter is None:
+            _shared_rate_limiter = RateLimiter()
+        return _shared_rate_limiter
+
+
+def _request_model_and_tokens(request: "httpx.Request") -> Tuple[str, int]:
+    """Extrai o modelo e a estimativa de tokens do corpo JSON de uma requisição."""
+    try:
+        body = json.loads(request.content or b"{}")
+    except (httpx.RequestNotRead, ValueError):
+        return "", 1
+    if not isinstance(body, dict):
+        return "", 1
+    return body.get("model", ""), estimate_request_tokens(body)
+
+
+def rate_limited_http_client(limiter: Optional[RateLimiter] = None) -> "httpx.Client":
+    """
+    Cliente httpx para OpenAI(http_client=...) e ChatOpenAI(http_client=...):
+    cada requisição aguarda o limitador e cada resposta atualiza os baldes.
+    """
+    limiter = limiter or get_openai_rate_limiter()
+
+    def on_request(request: "httpx.Request"):
+        model, tokens = _request_model_and_tokens(request)
+        request.extensions["rate_limit_model"] = model
+        limiter.acquire(model, tokens)
+
+    def on_response(response: "httpx.Response"):
+        limiter.update_from_headers(response.request.extensions.get("rate_limit_model", ""),
+                                    response.status_code, response.headers)
+
+    return httpx.Client(event_hooks={"request": [on_request], "response": [on_response]},
+                        timeout=httpx.Timeout(600.0, connect=10.0))
+
+
+def rate_limited_async_http_client(limiter: Optional[RateLimiter] = None) -> "httpx.AsyncClient":
+    """Equivalente assíncrono de rate_limited_http_client (ex.: ChatOpenAI(http_async_client=...))."""
+    limiter = limiter or get_openai_rate_limiter()
+
+    async def on_request(request: "httpx.Request"):
+        model, tokens = _request_model_and_tokens(request)
+        request.extensions["rate_limit_model"] = model
+        await limiter.acquire_async(model, tokens)
+
+    async def on_response(response: "httpx.Response"):
+        limiter.update_from_headers(response.request.extensions.get("rate_limit_model", ""),
+                                    response.status_code, response.headers)
+
+    return httpx.AsyncClient(event_hooks={"request": [on_request], "response": [on_response]},
+                             timeout=httpx.Timeout(600.0, connect=10.0))